@@ -0,0 +1,46 @@
+"""tenant dimension on users and sessions
+
+Revision ID: 8c41f0a2d6e9
+Revises: 5b2d9e41c7a3
+Create Date: 2026-10-19 11:03:27.554120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41f0a2d6e9'
+down_revision = '5b2d9e41c7a3'
+branch_labels = None
+depends_on = None
+
+# La UniqueConstraint('email') original no tiene nombre: en SQLite se le da uno
+# para poder borrarla en modo batch, en Postgres se usa el nombre que generó.
+SQLITE_NAMING = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def _email_constraint_name():
+    return 'uq_user_email' if op.get_bind().dialect.name == 'sqlite' else 'user_email_key'
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None, naming_convention=SQLITE_NAMING) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.String(length=64), server_default='default', nullable=False))
+        batch_op.drop_constraint(_email_constraint_name(), type_='unique')
+        batch_op.create_unique_constraint('uq_user_tenant_email', ['tenant_id', 'email'])
+
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.String(length=64), server_default='default', nullable=False))
+        batch_op.create_index('ix_user_session_tenant_id_user_id', ['tenant_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_session', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_session_tenant_id_user_id')
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('user', schema=None, naming_convention=SQLITE_NAMING) as batch_op:
+        batch_op.drop_constraint('uq_user_tenant_email', type_='unique')
+        batch_op.create_unique_constraint(_email_constraint_name(), ['email'])
+        batch_op.drop_column('tenant_id')
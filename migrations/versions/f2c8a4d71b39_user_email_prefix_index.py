@@ -0,0 +1,29 @@
+"""email prefix index for the admin search
+
+Revision ID: f2c8a4d71b39
+Revises: d19b6e0f4a87
+Create Date: 2026-10-19 16:20:14.882731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a4d71b39'
+down_revision = 'd19b6e0f4a87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # En Postgres se crea CONCURRENTLY para no bloquear escrituras en tablas grandes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_email_prefix', 'user', ['email'], unique=False,
+                        postgresql_ops={'email': 'varchar_pattern_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_email_prefix', table_name='user', postgresql_concurrently=True)
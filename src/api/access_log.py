@@ -0,0 +1,135 @@
+"""
+Logs de acceso estructurados (una línea JSON por request).
+
+Los registros pasan por una cola acotada y un QueueListener los escribe desde
+otro hilo, así los hilos de request nunca esperan por I/O de logs. Si la cola
+se llena, el registro se descarta y se cuenta en lugar de bloquear.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ACCESS_LOGGER_NAME = 'api.access'
+
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname}
+        entry.update(getattr(record, 'fields', None) or {'message': record.getMessage()})
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta (y cuenta) en lugar de bloquear con la cola llena"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Los campos ya son serializables; evita el formateo en el hilo del request
+        return record
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is not None:
+        try:
+            g.db_time = g.get('db_time', 0.0) + time.perf_counter() - started
+        except RuntimeError:
+            pass  # Consulta fuera de un contexto de app (CLI, planificador...)
+
+
+class AccessLog:
+
+    def __init__(self, app=None):
+        self.logger = logging.getLogger(ACCESS_LOGGER_NAME)
+        self.handler = None
+        self.listener = None
+        self.sample_rate = 1.0
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ACCESS_LOG_ENABLED', True)
+        # Fracción de respuestas 2xx/3xx que se registran; los errores siempre
+        app.config.setdefault('ACCESS_LOG_SAMPLE_RATE', 1.0)
+        app.config.setdefault('ACCESS_LOG_QUEUE_SIZE', 10000)
+        app.config.setdefault('ACCESS_LOG_FILE', None)
+        self.enabled = app.config['ACCESS_LOG_ENABLED']
+        self.sample_rate = app.config['ACCESS_LOG_SAMPLE_RATE']
+
+        if self.listener is None:
+            if app.config['ACCESS_LOG_FILE']:
+                target = logging.FileHandler(app.config['ACCESS_LOG_FILE'])
+            else:
+                target = logging.StreamHandler(sys.stdout)
+            target.setFormatter(JSONFormatter())
+
+            self.handler = DroppingQueueHandler(queue.Queue(app.config['ACCESS_LOG_QUEUE_SIZE']))
+            self.listener = logging.handlers.QueueListener(self.handler.queue, target)
+            self.listener.start()
+
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(self.handler)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.extensions['access_log'] = self
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        if not self.enabled:
+            return response
+        status = response.status_code
+        if status < 400 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return response
+
+        started = g.get('request_started')
+        fields = {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else request.path,
+            'status': status,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2) if started else None,
+            'db_ms': round(g.get('db_time', 0.0) * 1000, 2),
+            'user_id': g.get('current_user_id'),
+        }
+        if g.get('auth_failure'):
+            fields['auth_failure'] = g.auth_failure
+
+        self.logger.log(logging.ERROR if status >= 500 else logging.INFO,
+                        fields['route'], extra={'fields': fields})
+        return response
+
+    def stop(self):
+        """Vacía la cola y detiene el hilo escritor"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+access_log = AccessLog()
@@ -1,17 +1,153 @@
-  
+"""
+Panel de administración (flask-admin) pensado para tablas de usuarios grandes.
+
+La vista de User no usa COUNT(*) ni OFFSET: pagina por keyset sobre el id
+(?after=<id> / ?before=<id>), muestra un conteo aproximado tomado de las
+estadísticas de Postgres (pg_class.reltuples) y busca por prefijo de email
+con el índice ix_user_email_prefix. Las acciones en bloque son un único
+UPDATE por conjunto de ids.
+
+Solo es accesible con HTTP Basic contra ADMIN_USERNAME / ADMIN_PASSWORD; sin
+ADMIN_PASSWORD configurada el panel queda cerrado.
+"""
+import hmac
 import os
-from flask_admin import Admin
-from .models import db, User
+import time
+from flask import flash, g, request, Response
+from flask_admin import Admin, AdminIndexView
+from flask_admin.actions import action
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.theme import Bootstrap4Theme
+from sqlalchemy import and_, select, text, update
+from .models import db, User
+from .invalidation import invalidation_bus
+from .sqlite_tuning import sqlite_profile
+
+# La estimación de pg_class cambia con cada ANALYZE; no hace falta leerla por página
+APPROXIMATE_COUNT_TTL = 60
+_approximate_count = (0.0, None)
+
+
+def approximate_user_count():
+    """Filas estimadas de la tabla user según Postgres; None en otras bases"""
+    global _approximate_count
+    cached_at, value = _approximate_count
+    if time.monotonic() - cached_at < APPROXIMATE_COUNT_TTL:
+        return value
+    value = None
+    if db.engine.dialect.name == 'postgresql':
+        value = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass('\"user\"')")).scalar()
+        # -1 o 0: la tabla nunca se analizó
+        value = value if value and value > 0 else None
+    _approximate_count = (time.monotonic(), value)
+    return value
+
+
+def email_prefix_filter(prefix):
+    """Condición de prefijo de email que puede resolverse con ix_user_email_prefix"""
+    if db.engine.dialect.name == 'postgresql':
+        # El índice usa varchar_pattern_ops, que es lo que permite LIKE 'abc%'
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return User.email.like(escaped + '%', escape='\\')
+    # SQLite: LIKE no usa el índice (no distingue mayúsculas), un rango sí
+    return and_(User.email >= prefix, User.email < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+class ProtectedMixin:
+
+    def is_accessible(self):
+        auth = request.authorization
+        username = os.environ.get('ADMIN_USERNAME', 'admin')
+        password = os.environ.get('ADMIN_PASSWORD')
+        return bool(password and auth and auth.password is not None
+                    and hmac.compare_digest(auth.username or '', username)
+                    and hmac.compare_digest(auth.password, password))
+
+    def inaccessible_callback(self, name, **kwargs):
+        return Response('Authentication required', 401, {'WWW-Authenticate': 'Basic realm="admin"'})
+
+
+class ProtectedIndexView(ProtectedMixin, AdminIndexView):
+    pass
+
+
+class UserAdminView(ProtectedMixin, ModelView):
+    list_template = 'admin/model/user_list.html'
+    column_list = ('id', 'tenant_id', 'email', 'is_active', 'last_login_at')
+    column_searchable_list = ('email',)
+    # El orden lo fija el keyset (id descendente)
+    column_sortable_list = ()
+    form_columns = ('tenant_id', 'email', 'is_active')
+    can_create = False
+    # Borrar carga fila por fila y choca con user_session: se desactiva en su lugar
+    can_delete = False
+    can_set_page_size = False
+    page_size = 50
+
+    def search_placeholder(self):
+        return 'Email prefix'
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        """Página por keyset: ?after=<id> la siguiente, ?before=<id> la anterior"""
+        page_size = page_size or self.page_size
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
+
+        query = select(User)
+        search = (search or '').strip().lower()
+        if search:
+            query = query.where(email_prefix_filter(search))
+        if after is not None:
+            query = query.where(User.id < after).order_by(User.id.desc())
+        elif before is not None:
+            query = query.where(User.id > before).order_by(User.id.asc())
+        else:
+            query = query.order_by(User.id.desc())
+
+        rows = db.session.execute(query.limit(page_size + 1)).scalars().all()
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if before is not None:
+            rows.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = after is not None, more
+
+        g.user_keyset = {
+            'prev': rows[0].id if rows and has_prev else None,
+            'next': rows[-1].id if rows and has_next else None,
+            'search': search or None,
+        }
+        return (None if search else approximate_user_count()), rows
+
+    def _set_active(self, ids, active):
+        ids = [int(user_id) for user_id in ids]
+        sqlite_profile.begin_write(db.session)
+        # Un solo UPDATE; el aviso va en la misma transacción para que los workers invaliden
+        invalidation_bus.publish(ids)
+        result = db.session.execute(
+            update(User).where(User.id.in_(ids), User.is_active != active).values(is_active=active))
+        db.session.commit()
+        return result.rowcount
+
+    @action('deactivate', 'Deactivate', 'Deactivate the selected users?')
+    def action_deactivate(self, ids):
+        flash(f'{self._set_active(ids, False)} users deactivated')
+
+    @action('activate', 'Activate', 'Activate the selected users?')
+    def action_activate(self, ids):
+        flash(f'{self._set_active(ids, True)} users activated')
+
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
-    app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    admin = Admin(app, name='4Geeks Admin', index_view=ProtectedIndexView(),
+                  theme=Bootstrap4Theme(swatch='cerulean'))
 
-    
-    # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    # User con paginación keyset, conteo aproximado y acciones en bloque
+    admin.add_view(UserAdminView(User, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+    return admin
@@ -0,0 +1,209 @@
+"""
+Audit log de logins con escritura diferida (write-behind).
+
+login solo encola el evento en un buffer en memoria acotado; un hilo del
+worker lo vacía por lotes (AUDIT_FLUSH_SIZE eventos o cada
+AUDIT_FLUSH_INTERVAL segundos) con un único INSERT multi-fila. El
+last_login_at de cada usuario se acumula aparte y se escribe una vez por
+flush, así que 50 logins del mismo usuario en un minuto son un solo UPDATE.
+
+Si la base va lenta el buffer se llena: record() espera como mucho
+AUDIT_BLOCK_TIMEOUT a que haya lugar (backpressure) y si no, descarta el
+evento y lo cuenta en audit.dropped. Un flush que falla por la base (caída,
+timeout) se reencola; si falla por los datos (DataError, IntegrityError)
+reintentar no sirve: los eventos se escriben de a uno y los que la base
+rechaza se descartan y se cuentan en audit.rejected.
+
+La IP es request.remote_addr: X-Forwarded-For solo cuenta si la app está
+detrás de proxies de confianza (TRUSTED_PROXY_HOPS, ver app.py), y se guarda
+solo si es una dirección válida.
+"""
+import atexit
+import ipaddress
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+from api.metrics import metrics
+from api.models import db, AuditEvent, User, DEFAULT_TENANT
+from api.sqlite_tuning import sqlite_profile
+
+
+def _client_ip():
+    if not has_request_context() or not request.remote_addr:
+        return None
+    try:
+        ip = str(ipaddress.ip_address(request.remote_addr))
+    except ValueError:
+        return None
+    # Una IPv6 con scope (fe80::1%eth0) puede pasarse de la columna
+    return ip if len(ip) <= AuditEvent.ip.type.length else None
+
+
+class AuditLog:
+
+    def __init__(self, app=None):
+        self.app = None
+        self.capacity = 10000
+        self.flush_size = 500
+        self.flush_interval = 2.0
+        self.block_timeout = 0.05
+        self._events = deque()
+        self._last_logins = {}  # user_id -> último login, pendiente de escribir
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_BUFFER_SIZE', 10000)
+        app.config.setdefault('AUDIT_FLUSH_SIZE', 500)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 2.0)
+        app.config.setdefault('AUDIT_BLOCK_TIMEOUT', 0.05)
+        self.app = app
+        self.capacity = app.config['AUDIT_BUFFER_SIZE']
+        self.flush_size = app.config['AUDIT_FLUSH_SIZE']
+        self.flush_interval = app.config['AUDIT_FLUSH_INTERVAL']
+        self.block_timeout = app.config['AUDIT_BLOCK_TIMEOUT']
+        app.extensions['audit_log'] = self
+        metrics.gauge('audit.buffered', lambda: len(self._events))
+        atexit.register(self.stop)
+
+    def record(self, event, user_id=None, email=None, reason=None, tenant_id=None, touch_login=False):
+        """Encola un evento; con touch_login también actualiza (en diferido) last_login_at"""
+        now = datetime.utcnow()
+        row = {
+            'tenant_id': tenant_id or DEFAULT_TENANT,
+            'event': event,
+            'user_id': user_id,
+            'email': email,
+            'reason': reason,
+            'ip': _client_ip(),
+            'created_at': now,
+        }
+        self._ensure_thread()
+        with self._cond:
+            if len(self._events) >= self.capacity:
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: len(self._events) < self.capacity, self.block_timeout)
+            if len(self._events) >= self.capacity:
+                metrics.incr('audit.dropped')
+                return False
+            self._events.append(row)
+            if touch_login and user_id is not None:
+                self._last_logins[user_id] = now
+            if len(self._events) >= self.flush_size:
+                self._cond.notify_all()
+        return True
+
+    def _ensure_thread(self):
+        # Se arranca en el primer evento: así cada worker de gunicorn tiene el suyo tras el fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopping = False
+                    self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or len(self._events) >= self.flush_size,
+                                    self.flush_interval)
+                stopping = self._stopping
+            with self.app.app_context():
+                self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """Escribe lo acumulado: eventos en lotes de flush_size y un UPDATE por usuario"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = [self._events.popleft() for _ in range(min(self.flush_size, len(self._events)))]
+                    last_logins, self._last_logins = self._last_logins, {}
+                    # Hay lugar otra vez: despierta a los record() que esperaban
+                    self._cond.notify_all()
+                if not batch and not last_logins:
+                    return written
+
+                started = time.perf_counter()
+                try:
+                    rejected = self._write(batch, last_logins)
+                except Exception:
+                    db.session.rollback()
+                    metrics.incr('audit.flush_errors')
+                    self.app.logger.exception('Audit log flush failed')
+                    self._requeue(batch, last_logins)
+                    return written
+                metrics.observe('audit.flush', time.perf_counter() - started)
+                metrics.incr('audit.written', len(batch) - rejected)
+                metrics.incr('audit.last_login_updates', len(last_logins))
+                written += len(batch) - rejected
+                if len(batch) < self.flush_size:
+                    return written
+
+    def _write(self, batch, last_logins):
+        """Escribe el lote en una transacción; devuelve cuántos eventos rechazó la base"""
+        sqlite_profile.begin_write(db.session)
+        try:
+            if batch:
+                db.session.execute(insert(AuditEvent), batch)
+            self._touch_logins(last_logins)
+            db.session.commit()
+            return 0
+        except (DataError, IntegrityError):
+            db.session.rollback()
+            self.app.logger.exception('Audit log batch rejected, writing events one by one')
+
+        # Error de los datos, no de la base: reencolar el lote lo haría fallar para siempre
+        sqlite_profile.begin_write(db.session)
+        rejected = 0
+        for row in batch:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(AuditEvent), [row])
+            except (DataError, IntegrityError):
+                rejected += 1
+        self._touch_logins(last_logins)
+        db.session.commit()
+        metrics.incr('audit.rejected', rejected)
+        return rejected
+
+    def _touch_logins(self, last_logins):
+        if last_logins:
+            # UPDATE de Core: un usuario borrado entre medio no hace fallar el lote
+            db.session.execute(
+                update(User.__table__).where(User.__table__.c.id == bindparam('user_id'))
+                .values(last_login_at=bindparam('at')),
+                [{'user_id': user_id, 'at': at} for user_id, at in last_logins.items()])
+
+    def _requeue(self, batch, last_logins):
+        with self._cond:
+            room = max(self.capacity - len(self._events), 0)
+            if len(batch) > room:
+                metrics.incr('audit.dropped', len(batch) - room)
+                batch = batch[len(batch) - room:]
+            self._events.extendleft(reversed(batch))
+            for user_id, at in last_logins.items():
+                self._last_logins[user_id] = max(at, self._last_logins.get(user_id, at))
+
+    def stop(self, timeout=5):
+        """Detiene el hilo tras un último flush (al salir del proceso)"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread.join(timeout)
+
+
+audit_log = AuditLog()
@@ -0,0 +1,174 @@
+"""
+Backfills en línea para migraciones sobre tablas grandes (user).
+
+Un UPDATE de toda la tabla dentro de la transacción de Alembic la bloquea
+durante minutos. El patrón con este módulo es:
+
+1. Una revisión agrega la columna como nullable (instantáneo) y declara el
+   backfill en BACKFILLS; su upgrade() llama a run_backfills(BACKFILLS).
+2. El backfill recorre la tabla por keyset sobre el id, en lotes que se
+   confirman por separado, con una pausa entre lotes. El tamaño del lote se
+   reduce a la mitad si un lote tarda más de max_chunk_seconds.
+3. Tras cada lote se guarda el último id en backfill_checkpoint, en la misma
+   transacción que el UPDATE: si se corta, se retoma desde ahí.
+4. Una revisión posterior agrega el NOT NULL o el índice.
+
+Ejemplo de revisión:
+
+    BACKFILLS = [
+        Backfill('user_email_normalized', 'user',
+                 values={'email_normalized': 'lower(trim(email))'},
+                 where='email_normalized IS NULL'),
+    ]
+
+    def upgrade():
+        op.add_column('user', sa.Column('email_normalized', sa.String(120), nullable=True))
+        run_backfills(BACKFILLS)
+
+Con `flask db upgrade -x backfill=defer` la revisión solo cambia el esquema y
+el backfill se corre aparte, con el servicio arriba: `flask backfill <nombre>`.
+"""
+import logging
+import time
+from datetime import datetime
+import sqlalchemy as sa
+from api.models import BackfillCheckpoint
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def _expression(value):
+    return sa.literal_column(value) if isinstance(value, str) else value
+
+
+class Backfill:
+
+    def __init__(self, name, table, values, where=None, key='id', chunk_size=1000,
+                 pause=0.05, max_chunk_seconds=1.0):
+        self.name = name
+        self.table = table
+        self.values = values  # columna -> expresión SQL (str) o expresión de SQLAlchemy
+        self.where = where  # condición de las filas que aún faltan
+        self.key = key
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_chunk_seconds = max_chunk_seconds
+
+    def checkpoint(self, connection):
+        return connection.execute(
+            sa.select(BackfillCheckpoint.last_key, BackfillCheckpoint.rows, BackfillCheckpoint.finished_at)
+            .where(BackfillCheckpoint.name == self.name)).first()
+
+    def _save(self, connection, last_key, rows, finished=False):
+        now = datetime.utcnow()
+        values = {'last_key': last_key, 'rows': rows, 'updated_at': now,
+                  'finished_at': now if finished else None}
+        table = BackfillCheckpoint.__table__
+        if not connection.execute(table.update().where(table.c.name == self.name).values(**values)).rowcount:
+            connection.execute(table.insert().values(name=self.name, **values))
+
+    def reset(self, connection):
+        with connection.begin():
+            connection.execute(BackfillCheckpoint.__table__.delete()
+                               .where(BackfillCheckpoint.name == self.name))
+
+    def run(self, connection, progress=None, max_chunks=None):
+        """Ejecuta (o retoma) el backfill; cada lote es una transacción propia. Devuelve filas actualizadas"""
+        values = {name: _expression(value) for name, value in self.values.items()}
+        where = sa.text(self.where) if isinstance(self.where, str) else self.where
+        # Cada lote lee y luego escribe: en SQLite con BEGIN IMMEDIATE (ver sqlite_tuning.py)
+        connection = connection.execution_options(sqlite_write=True)
+
+        # Lecturas iniciales en una transacción explícita: así cada lote puede abrir la suya
+        with connection.begin():
+            table = sa.Table(self.table, sa.MetaData(), autoload_with=connection)
+            key = table.c[self.key]
+            checkpoint = self.checkpoint(connection)
+            low, high = connection.execute(sa.select(sa.func.min(key), sa.func.max(key))).first()
+        if checkpoint is not None and checkpoint.finished_at is not None:
+            return 0
+        last_key, rows = (checkpoint.last_key, checkpoint.rows) if checkpoint else (None, 0)
+        if last_key is None:
+            last_key = (low - 1) if low is not None else 0
+        chunk_size = self.chunk_size
+        first_key = last_key
+        started = time.monotonic()
+        updated = chunks = 0
+
+        while max_chunks is None or chunks < max_chunks:
+            chunk_started = time.monotonic()
+            with connection.begin():
+                window = sa.select(key).where(key > last_key).order_by(key).limit(chunk_size).subquery()
+                upper = connection.execute(sa.select(sa.func.max(window.c[self.key]))).scalar()
+                if upper is None:
+                    self._save(connection, last_key, rows, finished=True)
+                    break
+                statement = sa.update(table).where(key > last_key, key <= upper).values(**values)
+                if where is not None:
+                    statement = statement.where(where)
+                count = connection.execute(statement).rowcount
+                rows += count
+                self._save(connection, upper, rows)
+            updated += count
+            chunks += 1
+            last_key = upper
+
+            # Si el lote tardó de más se achica (menos tiempo con locks tomados); si no, vuelve a crecer
+            elapsed = time.monotonic() - chunk_started
+            if elapsed > self.max_chunk_seconds:
+                chunk_size = max(chunk_size // 2, 10)
+            elif chunk_size < self.chunk_size:
+                chunk_size = min(chunk_size * 2, self.chunk_size)
+
+            if progress is not None:
+                running = max(time.monotonic() - started, 1e-9)
+                span = (high - low + 1) if high is not None else 0
+                done = min((last_key - low + 1) / span, 1.0) if span else 1.0
+                # ETA según el avance de esta ejecución (al retomar, lo anterior no cuenta)
+                remaining = max(high - last_key, 0) if high is not None else 0
+                progress({'name': self.name, 'last_key': last_key, 'rows': rows, 'chunk_size': chunk_size,
+                          'percent': round(done * 100, 1), 'rows_per_second': round(updated / running),
+                          'eta_seconds': round(remaining * running / (last_key - first_key))})
+            if self.pause:
+                time.sleep(self.pause)
+        return updated
+
+
+def _progress_logger(interval=5.0):
+    last = [0.0]
+
+    def log(report):
+        # Una línea cada `interval` segundos y la del final, no una por lote
+        if time.monotonic() - last[0] >= interval or report['percent'] >= 100:
+            last[0] = time.monotonic()
+            logger.info("Backfill %(name)s: %(percent)s%% (id %(last_key)s, %(rows)s rows, "
+                        "%(rows_per_second)s rows/s, ETA %(eta_seconds)ss)", report)
+    return log
+
+
+def run_backfills(backfills):
+    """Desde upgrade() de una revisión: corre los backfills fuera de la transacción de la migración"""
+    from alembic import context, op
+
+    if context.get_x_argument(as_dictionary=True).get('backfill') == 'defer':
+        for backfill in backfills:
+            logger.info("Backfill %s deferred: run `flask backfill %s`", backfill.name, backfill.name)
+        return
+    # Confirma lo que lleva la migración (p. ej. el add_column) y usa una conexión aparte,
+    # con una transacción por lote
+    with op.get_context().autocommit_block():
+        with op.get_bind().engine.connect() as connection:
+            for backfill in backfills:
+                backfill.run(connection, progress=_progress_logger())
+
+
+def find_backfill(app, name):
+    """Busca el backfill declarado (BACKFILLS) en las revisiones de migrations/"""
+    from alembic.script import ScriptDirectory
+
+    script = ScriptDirectory.from_config(app.extensions['migrate'].migrate.get_config())
+    for revision in script.walk_revisions():
+        for backfill in getattr(revision.module, 'BACKFILLS', ()):
+            if backfill.name == name:
+                return backfill
+    return None
@@ -1,6 +1,25 @@
 
+import base64
+import os
+import threading
 import click
-from api.models import db, User
+import time
+import tracemalloc
+from sqlalchemy import select, func, insert, delete
+from api.models import db, User, UserSession, UserPrincipal, BackfillCheckpoint
+from api.sessions import session_registry
+from api.scheduler import scheduler
+from api.access_log import access_log
+from api.tenants import partition_ddl
+from api.schemas import SIGNUP_SCHEMA, LOGIN_SCHEMA
+from api.shared_cache import token_cache
+from api.hashers import password_hashers, BcryptHasher
+from api.sqlite_tuning import sqlite_profile
+from api.write_queue import signup_writer
+from api.backfill import find_backfill
+from api.static_files import static_site
+from api.invalidation import invalidation_bus
+from api.metrics import metrics
 
 """
 In this file, you can add as many commands as you want using the @app.cli.command decorator
@@ -31,4 +50,356 @@ def setup_commands(app):
 
     @app.cli.command("insert-test-data")
     def insert_test_data():
-        pass
\ No newline at end of file
+        pass
+
+    @app.cli.command("sweep-sessions")
+    @click.option("--batch-size", default=1000, help="Filas borradas por transacción")
+    @click.option("--pause", default=0.0, help="Segundos de espera entre lotes")
+    def sweep_sessions(batch_size, pause):
+        """Borra por lotes las sesiones expiradas o revocadas hace tiempo: $ flask sweep-sessions"""
+        deleted = session_registry.sweep(batch_size=batch_size, pause=pause)
+        print("Sessions deleted: ", deleted)
+
+    @app.cli.command("tenant-partition-ddl")
+    @click.argument("tenants", nargs=-1)
+    def tenant_partition_ddl(tenants):
+        """Imprime el DDL opcional de Postgres para particionar "user" por tenant"""
+        print(partition_ddl(tenants))
+
+    """
+    Tareas periódicas: corren con `flask run-scheduler` o dentro de los workers
+    si SCHEDULER_ENABLED=1 (ver wsgi.py)
+    """
+    scheduler.init_app(app)
+
+    @scheduler.job("sweep-sessions", interval=app.config.get('SESSION_SWEEP_INTERVAL', 300))
+    def sweep_expired_sessions():
+        session_registry.sweep(batch_size=1000)
+
+    # Cada worker tiene su propio índice, así que esta no depende del líder
+    @scheduler.job("refresh-session-index", interval=30, leader_only=False)
+    def refresh_session_index():
+        session_registry.refresh(force=True)
+
+    @scheduler.job("sweep-invalidations", interval=600)
+    def sweep_invalidations():
+        invalidation_bus.sweep()
+
+    @scheduler.job("rollup-stats", interval=600)
+    def rollup_stats():
+        scheduler.stats = {
+            "users": db.session.scalar(select(func.count(User.id))),
+            "active_sessions": db.session.scalar(
+                select(func.count(UserSession.id)).where(UserSession.revoked == False)),
+        }
+        app.logger.info("Stats rollup: %s", scheduler.stats)
+
+    @app.cli.command("run-scheduler")
+    def run_scheduler():
+        """Ejecuta el planificador en primer plano (proceso sidecar)"""
+        print("Scheduler running jobs: ", ", ".join(scheduler.jobs))
+        scheduler.run_forever()
+
+    @app.cli.command("bench-tokens")
+    @click.option("--count", default=10000, help="Número de tokens a codificar/decodificar")
+    def bench_tokens(count):
+        """Compara tamaño de header y rendimiento de los perfiles de token"""
+        user = User(id=123456, email="benchmark_user@example.com", is_active=True)
+        for profile in ("standard", "compact"):
+            for include_email in (True, False):
+                token = user.generate_token(profile=profile, include_email=include_email)
+
+                start = time.perf_counter()
+                for _ in range(count):
+                    user.verify_token(token)
+                decode_rate = count / (time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for x in range(count):
+                    # ids distintos para medir firmas reales y no aciertos de la caché
+                    User(id=x, email=user.email).generate_token(profile=profile, include_email=include_email)
+                encode_rate = count / (time.perf_counter() - start)
+
+                print(f"{profile:<9} email={str(include_email):<5} "
+                      f"header={len('Authorization: Bearer ' + token)} bytes "
+                      f"encode={encode_rate:,.0f}/s decode={decode_rate:,.0f}/s")
+
+    @app.cli.command("bench-access-log")
+    @click.option("--count", default=2000, help="Requests por escenario")
+    def bench_access_log(count):
+        """Mide requests/s de /api/hello con y sin logs de acceso"""
+        client = app.test_client()
+        enabled = access_log.enabled
+        for label, on in (("logging off", False), ("logging on", True)):
+            access_log.enabled = on
+            start = time.perf_counter()
+            for _ in range(count):
+                client.get("/api/hello")
+            print(f"{label:<12} {count / (time.perf_counter() - start):,.0f} req/s")
+        access_log.enabled = enabled
+        if access_log.handler is not None:
+            print("Dropped records: ", access_log.handler.dropped)
+
+    @app.cli.command("bench-auth-load")
+    @click.option("--count", default=2000, help="Lecturas por escenario")
+    def bench_auth_load(count):
+        """Compara cargar el User completo (ORM) contra el UserPrincipal por columnas"""
+        user_id = db.session.scalar(select(User.id).limit(1))
+        if user_id is None:
+            print("No users found, run: $ flask insert-test-users 1")
+            return
+
+        def orm_load():
+            user = db.session.get(User, user_id, populate_existing=True)
+            db.session.get(User, user_id).password  # lo que cargaba antes el token_required
+            return user.serialize()
+
+        def principal_load():
+            row = db.session.execute(UserPrincipal.select().where(User.id == user_id)).first()
+            return UserPrincipal(*row).serialize()
+
+        for label, load in (("orm entity", orm_load), ("principal", principal_load)):
+            db.session.expunge_all()
+            tracemalloc.start()
+            start = time.perf_counter()
+            for _ in range(count):
+                load()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            db.session.expunge_all()
+            print(f"{label:<11} {elapsed / count * 1e6:,.1f} us/load peak={peak / 1024:,.1f} KiB")
+
+    @app.cli.command("bench-validation")
+    @click.option("--count", default=100000, help="Validaciones por esquema")
+    def bench_validation(count):
+        """Mide el coste por request de validar los cuerpos de signup y login"""
+        samples = (
+            (SIGNUP_SCHEMA, {"email": " New.User@Example.com ", "password": "123456"}),
+            (LOGIN_SCHEMA, {"email": "new.user@example.com", "password": "123456",
+                            "token_profile": "compact"}),
+        )
+        for schema, body in samples:
+            start = time.perf_counter()
+            for _ in range(count):
+                schema.validate(body)
+            print(f"{schema.name:<7} {(time.perf_counter() - start) / count * 1e6:.2f} us/validation")
+
+    @app.cli.command("shared-cache-stats")
+    def shared_cache_stats():
+        """Ocupación y memoria de la caché de tokens compartida"""
+        for key, value in token_cache.stats().items():
+            print(f"{key}: {value}")
+
+    @app.cli.command("bench-hashers")
+    @click.option("--count", default=20, help="Hashes por algoritmo")
+    def bench_hashers(count):
+        """Hashes/s por núcleo y memoria por hash de cada algoritmo registrado"""
+        for name, hasher in password_hashers.hashers.items():
+            hashed = hasher.hash("benchmark-password")
+            start = time.perf_counter()
+            for _ in range(count):
+                hasher.verify(hashed, "benchmark-password")
+            rate = count / (time.perf_counter() - start)
+            # bcrypt usa ~4 KiB de estado; argon2 usa memory_cost KiB
+            memory = getattr(getattr(hasher, "_hasher", None), "memory_cost", 4)
+            preferred = " (preferred)" if hasher is password_hashers.preferred else ""
+            print(f"{name:<9} {rate:,.1f} verifications/s/core memory={memory:,} KiB/hash{preferred}")
+
+    @app.cli.command("compress-static")
+    @click.option("--directory", default=None, help="Build del frontend (por defecto dist/)")
+    @click.option("--min-size", default=1024, help="No se comprimen ficheros más chicos (bytes)")
+    def compress_static(directory, min_size):
+        """Genera las variantes .gz/.br del build para servirlas ya comprimidas"""
+        static_site.directory = directory or app.config['STATIC_SITE_DIR'] or \
+            os.path.join(app.root_path, '..', 'dist')
+        static_site.scan()
+        written = static_site.compress(min_size=min_size)
+        print(f"{written} compressed variants written for {len(static_site.manifest)} files")
+
+    @app.cli.command("bench-invalidation")
+    @click.option("--count", default=20, help="Cambios de usuario a publicar")
+    def bench_invalidation(count):
+        """Latencia entre el commit de un cambio de usuario y su recepción por el bus"""
+        user = User(email="invalidation_bench@example.com", is_active=True)
+        user.set_password("benchmark-password")
+        db.session.add(user)
+        db.session.commit()
+        invalidation_bus.start()
+        time.sleep(invalidation_bus.poll_interval)
+        latencies = []
+        try:
+            for _ in range(count):
+                received = metrics.counter("invalidation.received")
+                user.is_active = not user.is_active
+                db.session.commit()
+                committed = time.perf_counter()
+                while metrics.counter("invalidation.received") == received:
+                    if time.perf_counter() - committed > 10:
+                        raise click.ClickException("Invalidation not received after 10s")
+                    time.sleep(0.001)
+                latencies.append((time.perf_counter() - committed) * 1000)
+        finally:
+            invalidation_bus.stop()
+            db.session.delete(user)
+            db.session.commit()
+        latencies.sort()
+        mode = "LISTEN/NOTIFY" if invalidation_bus.uses_notify else f"polling every {invalidation_bus.poll_interval}s"
+        print(f"{mode}: p50={latencies[len(latencies) // 2]:.1f}ms "
+              f"p95={latencies[int(len(latencies) * 0.95) - 1]:.1f}ms max={latencies[-1]:.1f}ms")
+
+    @app.cli.command("bench-admin")
+    @click.option("--rows", default=1000000, help="Usuarios en la tabla para la medición")
+    @click.option("--cleanup", is_flag=True, help="Borrar al final los usuarios de prueba")
+    def bench_admin(rows, cleanup):
+        """Tiempo de render de la lista de usuarios del admin con una tabla grande"""
+        domain = "@admin-bench.example"
+        existing = db.session.scalar(select(func.count(User.id)).where(User.email.like(f"%{domain}")))
+        hashed = password_hashers.hash("benchmark-password")
+        for start in range(existing, rows, 10000):
+            db.session.execute(insert(User), [
+                {"email": f"user{i:07d}{domain}", "password": hashed, "is_active": True}
+                for i in range(start, min(start + 10000, rows))])
+            db.session.commit()
+        print(f"{db.session.scalar(select(func.count(User.id)))} users in table")
+
+        os.environ.setdefault("ADMIN_PASSWORD", "admin-bench")
+        client = app.test_client()
+        auth = {"Authorization": "Basic " + base64.b64encode(
+            f"{os.environ.get('ADMIN_USERNAME', 'admin')}:{os.environ['ADMIN_PASSWORD']}".encode()).decode()}
+        deep_cursor = db.session.scalar(select(func.min(User.id))) + 100
+        pages = {
+            "first page": "/admin/user/",
+            "deep page (keyset)": f"/admin/user/?after={deep_cursor}",
+            "email prefix search": "/admin/user/?search=user05",
+        }
+        for name, url in pages.items():
+            client.get(url, headers=auth)
+            started = time.perf_counter()
+            for _ in range(5):
+                response = client.get(url, headers=auth)
+            print(f"{name:<22} {(time.perf_counter() - started) / 5 * 1000:8.1f}ms status={response.status_code}")
+
+        # Lo que hacía la vista genérica: COUNT(*) más OFFSET profundo
+        started = time.perf_counter()
+        db.session.scalar(select(func.count(User.id)))
+        db.session.execute(select(User).order_by(User.id).offset(rows - 100).limit(50)).all()
+        print(f"{'count + offset (old)':<22} {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+        ids = db.session.execute(select(User.id).where(User.email.like(f"%{domain}")).limit(50)).scalars().all()
+        started = time.perf_counter()
+        client.post("/admin/user/action/", headers=auth,
+                    data={"action": "deactivate", "rowid": [str(i) for i in ids], "url": "/admin/user/"})
+        print(f"{'bulk deactivate (50)':<22} {(time.perf_counter() - started) * 1000:8.1f}ms")
+
+        if cleanup:
+            db.session.execute(delete(User).where(User.email.like(f"%{domain}")))
+            db.session.commit()
+
+    @app.cli.command("bench-sqlite")
+    @click.option("--threads", default=16, help="Hilos concurrentes")
+    @click.option("--signups", default=2000, help="Signups por modo")
+    @click.option("--logins", default=2000, help="Logins (cada uno registra una sesión)")
+    @click.option("--reads", default=5000, help="Lecturas de /api/profile")
+    def bench_sqlite(threads, signups, logins, reads):
+        """Signups, logins y lecturas concurrentes contra la base actual, con y sin cola de escritura"""
+        with db.engine.connect() as connection:
+            print("pragmas:", sqlite_profile.settings(connection) if sqlite_profile.enabled else "not tuned")
+        # Hash barato: se mide la base, no el algoritmo de contraseñas
+        preferred = password_hashers.preferred
+        password_hashers.preferred = BcryptHasher(password_hashers.hashers["bcrypt"].bcrypt, 4)
+        run = str(int(time.time()))
+
+        def hammer(paths, worker):
+            client = app.test_client()
+            latencies, errors = [], 0
+            for index in range(worker, len(paths), threads):
+                method, url, kwargs = paths[index]
+                started = time.perf_counter()
+                status = client.open(url, method=method, **kwargs).status_code
+                latencies.append(time.perf_counter() - started)
+                errors += status >= 500
+            return latencies, errors
+
+        def measure(name, paths):
+            results = [None] * threads
+            workers = [threading.Thread(target=lambda w=w: results.__setitem__(w, hammer(paths, w)))
+                       for w in range(threads)]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+            latencies = sorted(latency for result in results for latency in result[0])
+            errors = sum(result[1] for result in results)
+            print(f"{name:<24} {len(paths) / elapsed:8.0f} req/s  p50={latencies[len(latencies) // 2] * 1000:6.1f}ms "
+                  f"p99={latencies[int(len(latencies) * 0.99)] * 1000:6.1f}ms  5xx={errors}")
+
+        try:
+            queue_enabled = signup_writer.enabled
+            for enabled in (False, True):
+                signup_writer.enabled = enabled
+                measure(f"signup ({'write queue' if enabled else 'direct'})", [
+                    ("POST", "/api/signup", {"json": {"email": f"sqlite{run}{int(enabled)}_{i}@bench.example",
+                                                      "password": "benchmark-password"}})
+                    for i in range(signups)])
+            signup_writer.enabled = queue_enabled
+
+            # Login = lectura del usuario + INSERT en user_session (y rehash/audit): lectura y escritura
+            measure("login (read + write)", [
+                ("POST", "/api/login", {"json": {"email": f"sqlite{run}1_{i % signups}@bench.example",
+                                                 "password": "benchmark-password"},
+                                        "headers": {"User-Agent": f"bench-{i}"}})
+                for i in range(logins)])
+
+            email = f"sqlite{run}1_0@bench.example"
+            token = app.test_client().post("/api/login", json={"email": email, "password": "benchmark-password"}).json["token"]
+            measure("profile (read)", [("GET", "/api/profile", {"headers": {"Authorization": f"Bearer {token}"}})] * reads)
+        finally:
+            password_hashers.preferred = preferred
+            bench_users = select(User.id).where(User.email.like(f"sqlite{run}%"))
+            db.session.execute(delete(UserSession).where(UserSession.user_id.in_(bench_users)))
+            db.session.execute(delete(User).where(User.email.like(f"sqlite{run}%")))
+            db.session.commit()
+
+    @app.cli.command("backfill")
+    @click.argument("name")
+    @click.option("--chunk-size", default=None, type=int, help="Filas por lote (por defecto, el de la revisión)")
+    @click.option("--pause", default=None, type=float, help="Segundos de pausa entre lotes")
+    @click.option("--max-chunks", default=None, type=int, help="Parar tras N lotes (se retoma luego)")
+    @click.option("--reset", is_flag=True, help="Empezar de cero, ignorando el checkpoint")
+    def backfill(name, chunk_size, pause, max_chunks, reset):
+        """Ejecuta o retoma un backfill declarado en una revisión de migrations/"""
+        spec = find_backfill(app, name)
+        if spec is None:
+            raise click.ClickException(f"No revision declares a backfill named {name}")
+        if chunk_size is not None:
+            spec.chunk_size = chunk_size
+        if pause is not None:
+            spec.pause = pause
+
+        last_report = [0.0]
+
+        def progress(report):
+            if time.monotonic() - last_report[0] >= 1:
+                last_report[0] = time.monotonic()
+                print(f"{report['percent']:5.1f}%  id={report['last_key']}  rows={report['rows']:,}  "
+                      f"{report['rows_per_second']:,} rows/s  chunk={report['chunk_size']}  "
+                      f"ETA {report['eta_seconds']}s")
+
+        with db.engine.connect() as connection:
+            if reset:
+                spec.reset(connection)
+            updated = spec.run(connection, progress=progress, max_chunks=max_chunks)
+            with connection.begin():
+                checkpoint = spec.checkpoint(connection)
+        state = "finished" if checkpoint and checkpoint.finished_at else "paused"
+        print(f"{name}: {updated:,} rows updated in this run, {state} at id {checkpoint.last_key if checkpoint else None}")
+
+    @app.cli.command("backfill-status")
+    def backfill_status():
+        """Estado de los backfills en línea"""
+        for checkpoint in db.session.execute(select(BackfillCheckpoint).order_by(BackfillCheckpoint.name)).scalars():
+            state = f"finished {checkpoint.finished_at:%Y-%m-%d %H:%M}" if checkpoint.finished_at else "in progress"
+            print(f"{checkpoint.name:<32} id={checkpoint.last_key}  rows={checkpoint.rows:,}  {state}")
@@ -0,0 +1,97 @@
+"""
+CORS con la política precalculada por origen.
+
+Reemplaza a flask-cors (que se aplicaba dos veces: en la app y en el blueprint
+api). Es un middleware WSGI: los preflight (OPTIONS con Origin y
+Access-Control-Request-Method) se contestan con un 204 y los headers ya
+armados, antes del routing, de los before_request y de cualquier acceso a la
+base o a las sesiones. Al resto de las respuestas solo se les agregan los
+headers del origen.
+
+Access-Control-Max-Age (CORS_MAX_AGE) deja al navegador reutilizar el
+preflight, así que la mayoría de las llamadas con Authorization no lo repiten.
+"""
+import time
+from api.metrics import metrics
+
+
+class CorsPolicy:
+
+    def __init__(self, app=None):
+        self.origins = ('*',)
+        self._preflight = {}  # origen -> headers del preflight
+        self._actual = {}  # origen -> headers de las respuestas normales
+        self._wsgi_app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CORS_ORIGINS', ('*',))
+        app.config.setdefault('CORS_ALLOW_METHODS', ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+        app.config.setdefault('CORS_ALLOW_HEADERS', ('Authorization', 'Content-Type', 'Idempotency-Key', 'X-Last-Write'))
+        app.config.setdefault('CORS_EXPOSE_HEADERS', ('Idempotent-Replayed', 'X-Last-Write'))
+        app.config.setdefault('CORS_MAX_AGE', 600)
+        app.config.setdefault('CORS_SUPPORTS_CREDENTIALS', False)
+        self.origins = tuple(app.config['CORS_ORIGINS'])
+        self._build(app.config)
+        self._wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+        app.extensions['cors_policy'] = self
+
+    def _build(self, config):
+        credentials = config['CORS_SUPPORTS_CREDENTIALS']
+        for origin in self.origins:
+            # Con credenciales el navegador no acepta '*': se devuelve el origen recibido
+            wildcard = origin == '*' and not credentials
+            common = [('Access-Control-Allow-Origin', '*' if wildcard else origin)]
+            if not wildcard:
+                common.append(('Vary', 'Origin'))
+            if credentials:
+                common.append(('Access-Control-Allow-Credentials', 'true'))
+            self._preflight[origin] = common + [
+                ('Access-Control-Allow-Methods', ', '.join(config['CORS_ALLOW_METHODS'])),
+                ('Access-Control-Allow-Headers', ', '.join(config['CORS_ALLOW_HEADERS'])),
+                ('Access-Control-Max-Age', str(config['CORS_MAX_AGE'])),
+                ('Content-Length', '0'),
+            ]
+            self._actual[origin] = common
+            if config['CORS_EXPOSE_HEADERS']:
+                self._actual[origin] = common + [
+                    ('Access-Control-Expose-Headers', ', '.join(config['CORS_EXPOSE_HEADERS']))]
+
+    def _policy(self, origin, policies):
+        headers = policies.get(origin)
+        if headers is None and '*' in policies:
+            headers = policies['*']
+            if headers[0][1] != '*':
+                headers = [('Access-Control-Allow-Origin', origin)] + headers[1:]
+        return headers
+
+    def __call__(self, environ, start_response):
+        origin = environ.get('HTTP_ORIGIN')
+        if origin is None:
+            return self._wsgi_app(environ, start_response)
+
+        if environ['REQUEST_METHOD'] == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            started = time.perf_counter()
+            headers = self._policy(origin, self._preflight)
+            if headers is None:
+                # Origen no permitido: sin headers CORS el navegador bloquea la llamada
+                metrics.incr('cors.preflight.rejected')
+                headers = [('Content-Length', '0')]
+            start_response('204 No Content', headers)
+            metrics.incr('cors.preflight')
+            metrics.observe('cors.preflight', time.perf_counter() - started)
+            return [b'']
+
+        headers = self._policy(origin, self._actual)
+        if headers is None:
+            return self._wsgi_app(environ, start_response)
+
+        def cors_start_response(status, response_headers, exc_info=None):
+            return start_response(status, response_headers + headers, exc_info)
+
+        return self._wsgi_app(environ, cors_start_response)
+
+
+cors_policy = CorsPolicy()
@@ -0,0 +1,108 @@
+"""
+Registro de algoritmos de hash de contraseñas.
+
+Cada hash guardado se asocia a su algoritmo por el prefijo ($2b$ para bcrypt,
+$argon2id$ para Argon2id). Los hashes nuevos usan el algoritmo preferido
+(PASSWORD_HASHER) y, tras un login correcto, los que están en otro algoritmo o
+con otros parámetros se regeneran con el preferido.
+
+argon2-cffi es opcional: si no está instalado solo se registra bcrypt.
+"""
+try:
+    from argon2 import PasswordHasher, Type
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # pragma: no cover - argon2-cffi no instalado
+    PasswordHasher = None
+
+
+class BcryptHasher:
+    name = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$')
+
+    def __init__(self, bcrypt, rounds=12):
+        self.bcrypt = bcrypt
+        self.rounds = rounds
+
+    def hash(self, password):
+        return self.bcrypt.generate_password_hash(password, self.rounds).decode('utf-8')
+
+    def verify(self, hashed, password):
+        return self.bcrypt.check_password_hash(hashed, password)
+
+    def needs_rehash(self, hashed):
+        return int(hashed.split('$')[2]) != self.rounds
+
+
+class Argon2Hasher:
+    name = 'argon2id'
+    prefixes = ('$argon2id$',)
+
+    def __init__(self, time_cost=2, memory_cost=19456, parallelism=1):
+        # memory_cost en KiB; los valores por defecto son los mínimos que recomienda OWASP
+        self._hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost,
+                                      parallelism=parallelism, type=Type.ID)
+
+    def hash(self, password):
+        return self._hasher.hash(password)
+
+    def verify(self, hashed, password):
+        try:
+            return self._hasher.verify(hashed, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, hashed):
+        return self._hasher.check_needs_rehash(hashed)
+
+
+class HasherRegistry:
+
+    def __init__(self):
+        self.hashers = {}
+        self.preferred = None
+
+    def register(self, hasher):
+        self.hashers[hasher.name] = hasher
+
+    def init_app(self, app, bcrypt):
+        """bcrypt es la extensión Flask-Bcrypt ya inicializada"""
+        app.config.setdefault('PASSWORD_HASHER', 'argon2id' if PasswordHasher is not None else 'bcrypt')
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('ARGON2_TIME_COST', 2)
+        app.config.setdefault('ARGON2_MEMORY_COST', 19456)
+        app.config.setdefault('ARGON2_PARALLELISM', 1)
+
+        self.hashers = {}
+        self.register(BcryptHasher(bcrypt, app.config['BCRYPT_LOG_ROUNDS']))
+        if PasswordHasher is not None:
+            self.register(Argon2Hasher(app.config['ARGON2_TIME_COST'],
+                                       app.config['ARGON2_MEMORY_COST'],
+                                       app.config['ARGON2_PARALLELISM']))
+
+        preferred = app.config['PASSWORD_HASHER']
+        if preferred not in self.hashers:
+            raise RuntimeError(f"Password hasher '{preferred}' is not available")
+        self.preferred = self.hashers[preferred]
+        app.extensions['password_hashers'] = self
+
+    def identify(self, hashed):
+        """Hasher que generó el hash, según su prefijo"""
+        for hasher in self.hashers.values():
+            if hashed.startswith(hasher.prefixes):
+                return hasher
+        return None
+
+    def hash(self, password):
+        return self.preferred.hash(password)
+
+    def verify(self, hashed, password):
+        hasher = self.identify(hashed)
+        return hasher is not None and hasher.verify(hashed, password)
+
+    def needs_upgrade(self, hashed):
+        """True si el hash no usa el algoritmo preferido o sus parámetros actuales"""
+        hasher = self.identify(hashed)
+        return hasher is not self.preferred or hasher.needs_rehash(hashed)
+
+
+password_hashers = HasherRegistry()
@@ -0,0 +1,102 @@
+"""
+Endpoints de liveness/readiness y rutina de calentamiento del worker.
+
+/healthz solo confirma que el proceso responde (sin I/O). /readyz hace ping a
+la base con timeout y comprueba que el calentamiento terminó: pool de
+conexiones abierto, bcrypt y JWT ejercitados e índice de sesiones cargado.
+Si el worker no se calentó al arrancar (WARM_UP=0, `flask run`, base caída
+al bootear), el primer /readyz lo hace.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+from api.models import db, User
+from api.hashers import password_hashers
+from api.replicas import replica_router
+from api.sessions import session_registry
+
+health = Blueprint('health', __name__)
+
+# Un hilo aparte para que un ping colgado no bloquee al worker más allá del timeout
+_ping_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='readyz')
+
+_warm = {'done': False, 'duration_ms': None}
+_warm_lock = threading.Lock()
+
+
+def _ping(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+
+def _ensure_warm(app):
+    """Calentamiento perezoso desde /readyz; si ya hay otro en curso no espera"""
+    if _warm['done'] or not _warm_lock.acquire(blocking=False):
+        return _warm['done']
+    try:
+        if not _warm['done']:
+            warm_up(app)
+    except Exception:
+        app.logger.exception('Warm-up failed')
+    finally:
+        _warm_lock.release()
+    return _warm['done']
+
+
+def warm_up(app):
+    """Prepara el worker antes de recibir tráfico; devuelve los ms que tardó"""
+    started = time.perf_counter()
+    with app.app_context():
+        # Abre tantas conexiones como el pool mantiene para no pagarlas en el primer pico
+        pool_size = getattr(db.engine.pool, 'size', lambda: 1)()
+        connections = []
+        try:
+            for _ in range(max(pool_size, 1)):
+                connections.append(db.engine.connect())
+                connections[-1].execute(text('SELECT 1'))
+        finally:
+            for connection in connections:
+                connection.close()
+        for bind_key in replica_router.bind_keys:
+            with db.engines[bind_key].connect() as connection:
+                connection.execute(text('SELECT 1'))
+
+        # Primera llamada al hasher de contraseñas y a PyJWT (carga de librerías, clave HMAC)
+        password_hashers.verify(password_hashers.hash('warm-up'), 'warm-up')
+        User.verify_token(User(id=0, email='warm-up@example.com').generate_token())
+
+        session_registry.refresh(force=True)
+        db.session.remove()
+
+    _warm['done'] = True
+    _warm['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return _warm['duration_ms']
+
+
+@health.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: el proceso responde"""
+    return jsonify({'status': 'ok'}), 200
+
+
+@health.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: base de datos accesible y worker calentado"""
+    checks = {'warm': _ensure_warm(current_app._get_current_object()), 'signing_key': bool(current_app.config.get('JWT_SECRET_KEY'))}
+
+    future = _ping_executor.submit(_ping, current_app._get_current_object())
+    try:
+        future.result(timeout=current_app.config.get('READINESS_DB_TIMEOUT', 2))
+        checks['database'] = True
+    except FutureTimeout:
+        checks['database'] = False
+    except Exception:
+        current_app.logger.exception('Readiness database ping failed')
+        checks['database'] = False
+
+    ready = all(checks.values())
+    return jsonify({'status': 'ready' if ready else 'not ready', 'checks': checks,
+                    'warm_up_ms': _warm['duration_ms']}), 200 if ready else 503
@@ -0,0 +1,125 @@
+"""
+Soporte del header Idempotency-Key para rutas POST.
+
+La primera respuesta para una clave se guarda en un almacén en memoria con
+tamaño máximo y TTL, y se reenvía tal cual a los reintentos con la misma clave.
+Si llega un duplicado mientras la primera petición sigue en curso, espera a
+que termine en vez de ejecutarla otra vez. Las claves son por tenant: dos
+aplicaciones cliente pueden generar la misma sin pisarse.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, make_response, request
+from api.tenants import resolve_tenant
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+
+    def __init__(self, max_entries=10000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()  # clave -> (expira, huella, status, headers, body)
+        self._in_flight = {}  # clave -> (huella, threading.Event)
+
+    def init_app(self, app):
+        app.config.setdefault('IDEMPOTENCY_TTL', 86400)
+        app.config.setdefault('IDEMPOTENCY_MAX_KEYS', 10000)
+        app.config.setdefault('IDEMPOTENCY_WAIT_TIMEOUT', 30)
+        self.ttl = app.config['IDEMPOTENCY_TTL']
+        self.max_entries = app.config['IDEMPOTENCY_MAX_KEYS']
+        app.extensions['idempotency_store'] = self
+
+    def begin(self, key, fingerprint):
+        """Devuelve ('replay', respuesta), ('wait', evento) o ('lead', evento)"""
+        now = time.monotonic()
+        with self._lock:
+            stored = self._responses.get(key)
+            if stored is not None:
+                if stored[0] > now:
+                    return 'replay', stored
+                del self._responses[key]
+            if key in self._in_flight:
+                return 'wait', self._in_flight[key]
+            event = threading.Event()
+            self._in_flight[key] = (fingerprint, event)
+            return 'lead', self._in_flight[key]
+
+    def complete(self, key, fingerprint, response=None):
+        with self._lock:
+            if response is not None:
+                self._responses[key] = (time.monotonic() + self.ttl, fingerprint,
+                                        response.status_code,
+                                        {'Content-Type': response.headers.get('Content-Type')},
+                                        response.get_data())
+                self._responses.move_to_end(key)
+                while len(self._responses) > self.max_entries:
+                    self._responses.popitem(last=False)
+            _, event = self._in_flight.pop(key)
+        event.set()
+
+    def get(self, key):
+        with self._lock:
+            stored = self._responses.get(key)
+        if stored is not None and stored[0] > time.monotonic():
+            return stored
+        return None
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _replay(stored, fingerprint):
+    if stored[1] != fingerprint:
+        return jsonify({'message': 'Idempotency-Key was already used with a different request'}), 422
+    _, _, status, headers, body = stored
+    response = make_response(body, status)
+    response.headers.update(headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(f):
+    """Decorador: respeta el header Idempotency-Key en rutas POST"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return f(*args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'message': 'Idempotency-Key is too long'}), 400
+
+        store_key = (resolve_tenant(), request.method, request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        state, value = idempotency_store.begin(store_key, fingerprint)
+
+        if state == 'replay':
+            return _replay(value, fingerprint)
+
+        if state == 'wait':
+            in_flight_fingerprint, event = value
+            if in_flight_fingerprint != fingerprint:
+                return jsonify({'message': 'Idempotency-Key was already used with a different request'}), 422
+            event.wait(current_app.config['IDEMPOTENCY_WAIT_TIMEOUT'])
+            stored = idempotency_store.get(store_key)
+            if stored is None:
+                return jsonify({'message': 'A request with this Idempotency-Key is still in progress'}), 409
+            return _replay(stored, fingerprint)
+
+        response = None
+        try:
+            response = make_response(f(*args, **kwargs))
+            return response
+        finally:
+            # Los errores 5xx no se guardan para que el cliente pueda reintentar
+            keep = response is not None and response.status_code < 500
+            idempotency_store.complete(store_key, fingerprint, response if keep else None)
+
+    return decorated
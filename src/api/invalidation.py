@@ -0,0 +1,224 @@
+"""
+Bus de invalidación de cachés entre workers e instancias.
+
+Cuando se confirma un cambio en un User (email, contraseña, is_active,
+tenant) o se borra, se publica su id:
+
+- En Postgres con NOTIFY dentro de la misma transacción, así que solo llega
+  si el commit se hace. Cada worker escucha con LISTEN en una conexión
+  propia, fuera del pool.
+- En otras bases (SQLite) se inserta una fila en invalidation_event y cada
+  worker la consulta cada INVALIDATION_POLL_INTERVAL segundos.
+
+Al recibir un aviso se ejecutan los handlers registrados (por defecto:
+tokens reutilizables de models y la caché compartida de tokens). El worker
+que hizo el cambio invalida además en el momento, sin esperar al aviso. La
+latencia entre el commit y la recepción queda en la métrica
+invalidation.propagation.
+"""
+import select as select_module
+import threading
+import time
+from sqlalchemy import event, delete, insert, inspect, select, text, func
+from api.metrics import metrics
+from api.models import db, User, InvalidationEvent, forget_tokens
+from api.shared_cache import token_cache
+
+CHANNEL = 'user_invalidation'
+# Columnas de User que invalidan lo cacheado; last_login_at, por ejemplo, no
+WATCHED_COLUMNS = ('email', 'password', 'is_active', 'tenant_id')
+
+
+def _evict_tokens(user_ids):
+    if user_ids is None:
+        forget_tokens(None)
+        token_cache.clear()
+        return
+    for user_id in user_ids:
+        forget_tokens(user_id)
+    # Una sola pasada por la caché compartida para todo el lote
+    token_cache.evict_users(user_ids)
+
+
+class InvalidationBus:
+
+    def __init__(self, app=None):
+        self.app = None
+        self.poll_interval = 1.0
+        self.handlers = [_evict_tokens]
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INVALIDATION_ENABLED', True)
+        app.config.setdefault('INVALIDATION_POLL_INTERVAL', 1.0)
+        app.config.setdefault('INVALIDATION_RETENTION', 3600)
+        self.app = app
+        self.poll_interval = app.config['INVALIDATION_POLL_INTERVAL']
+        app.extensions['invalidation_bus'] = self
+        if not event.contains(db.session, 'after_flush', self._after_flush):
+            event.listen(db.session, 'after_flush', self._after_flush)
+            event.listen(db.session, 'after_commit', self._after_commit)
+            event.listen(db.session, 'after_rollback', self._after_rollback)
+        if app.config['INVALIDATION_ENABLED']:
+            # El hilo se arranca en la primera petición: cada worker de gunicorn el suyo tras el fork
+            app.before_request(self.start)
+
+    def subscribe(self, handler):
+        """Registra handler(user_ids) (un set de ids); None significa "invalidar todo\""""
+        self.handlers.append(handler)
+        return handler
+
+    @property
+    def uses_notify(self):
+        return db.engine.dialect.name == 'postgresql'
+
+    # --- publicación -----------------------------------------------------
+
+    def _after_flush(self, session, flush_context):
+        changed = set()
+        for obj in session.dirty:
+            if isinstance(obj, User):
+                state = inspect(obj)
+                if any(state.attrs[name].history.has_changes() for name in WATCHED_COLUMNS):
+                    changed.add(obj.id)
+        changed.update(obj.id for obj in session.deleted if isinstance(obj, User))
+        if changed:
+            self.publish(changed, session)
+
+    def publish(self, user_ids, session=None):
+        """Publica los ids en la transacción de la sesión; se entregan al hacer commit"""
+        session = session or db.session
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return
+        now = time.time()
+        if self.uses_notify:
+            session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                            [{'channel': CHANNEL, 'payload': f'{user_id}:{now}'} for user_id in user_ids])
+        else:
+            session.execute(insert(InvalidationEvent),
+                            [{'user_id': user_id, 'published_at': now} for user_id in user_ids])
+        session.info.setdefault('invalidated_users', set()).update(user_ids)
+        metrics.incr('invalidation.published', len(user_ids))
+
+    def _after_commit(self, session):
+        user_ids = session.info.pop('invalidated_users', None)
+        if user_ids:
+            self._dispatch(user_ids)
+
+    def _after_rollback(self, session):
+        session.info.pop('invalidated_users', None)
+
+    # --- suscripción -----------------------------------------------------
+
+    def _dispatch(self, user_ids, published_at=()):
+        """Ejecuta los handlers para un lote de ids; published_at son los epoch de cada aviso"""
+        now = time.time()
+        for published in published_at:
+            metrics.incr('invalidation.received')
+            metrics.observe('invalidation.propagation', max(now - published, 0.0))
+        for handler in self.handlers:
+            try:
+                handler(user_ids)
+            except Exception:
+                self.app.logger.exception('Invalidation handler %r failed', handler)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            if self.uses_notify:
+                target, args = self._listen, ()
+            else:
+                # El cursor se fija aquí y no al arrancar el hilo: lo publicado desde ahora no se pierde
+                target, args = self._poll, (self._last_event_id(),)
+            self._thread = threading.Thread(target=target, args=args, name='invalidation-bus', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _listen(self):
+        # El hilo no tiene contexto de aplicación: db.engine se resuelve una vez dentro de uno
+        with self.app.app_context():
+            engine = db.engine
+        backoff = 1
+        while not self._stop.is_set():
+            connection = None
+            try:
+                # Conexión fuera del pool: queda tomada por LISTEN mientras viva el worker
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi = connection.dbapi_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                if backoff > 1:
+                    # Pudo haber cambios mientras no escuchábamos
+                    self._dispatch(None)
+                backoff = 1
+                while not self._stop.is_set():
+                    if select_module.select([dbapi], [], [], self.poll_interval)[0]:
+                        dbapi.poll()
+                        user_ids, published_at = set(), []
+                        while dbapi.notifies:
+                            user_id, published = dbapi.notifies.pop(0).payload.split(':')
+                            user_ids.add(int(user_id))
+                            published_at.append(float(published))
+                        if user_ids:
+                            self._dispatch(user_ids, published_at)
+            except Exception:
+                metrics.incr('invalidation.reconnects')
+                self.app.logger.exception('Invalidation listener failed, reconnecting')
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def _last_event_id(self):
+        try:
+            with self.app.app_context():
+                return db.session.scalar(select(func.max(InvalidationEvent.id))) or 0
+        except Exception:
+            # Sin base todavía: el hilo lo reintenta
+            return None
+
+    def _poll(self, cursor=None):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    if cursor is None:
+                        cursor = db.session.scalar(select(func.max(InvalidationEvent.id))) or 0
+                    rows = db.session.execute(
+                        select(InvalidationEvent.id, InvalidationEvent.user_id, InvalidationEvent.published_at)
+                        .where(InvalidationEvent.id > cursor)
+                        .order_by(InvalidationEvent.id)).all()
+                    db.session.remove()
+                if rows:
+                    self._dispatch({row.user_id for row in rows}, [row.published_at for row in rows])
+                    cursor = rows[-1].id
+            except Exception:
+                metrics.incr('invalidation.poll_errors')
+                self.app.logger.exception('Invalidation poll failed')
+            self._stop.wait(self.poll_interval)
+
+    def sweep(self):
+        """Borra los avisos de polling más viejos que INVALIDATION_RETENTION"""
+        cutoff = time.time() - self.app.config['INVALIDATION_RETENTION']
+        result = db.session.execute(delete(InvalidationEvent).where(InvalidationEvent.published_at < cutoff))
+        db.session.commit()
+        return result.rowcount
+
+
+invalidation_bus = InvalidationBus()
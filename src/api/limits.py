@@ -0,0 +1,74 @@
+"""
+Límites de tamaño y tipo de contenido del cuerpo de las peticiones.
+
+Se comprueban en un before_request, antes de que ninguna vista lea o parsee
+el cuerpo: Content-Length por encima del límite -> 413, y en los blueprints
+solo-JSON un Content-Type distinto -> 415. Para cuerpos sin Content-Length
+(chunked) se fija request.max_content_length y Werkzeug corta la lectura al
+superar el límite.
+
+El límite de cada ruta es, de más a menos específico: max_body de su esquema
+(use_schema), BLUEPRINT_MAX_CONTENT_LENGTH[blueprint] y MAX_CONTENT_LENGTH.
+"""
+from flask import jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+from api.metrics import metrics
+
+BODY_METHODS = frozenset(('POST', 'PUT', 'PATCH'))
+
+
+class RequestLimits:
+
+    def __init__(self, app=None):
+        self.app = None
+        self._limits = {}  # endpoint -> límite en bytes, calculado una vez
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAX_CONTENT_LENGTH', 1024 * 1024)
+        app.config.setdefault('BLUEPRINT_MAX_CONTENT_LENGTH', {})
+        app.config.setdefault('JSON_ONLY_BLUEPRINTS', ('api',))
+        self.app = app
+        app.before_request(self._check_body)
+        app.register_error_handler(RequestEntityTooLarge, self._too_large)
+        app.extensions['request_limits'] = self
+
+    def limit_for(self, endpoint, blueprint):
+        limit = self._limits.get(endpoint)
+        if limit is None:
+            schema = getattr(self.app.view_functions.get(endpoint), 'request_schema', None)
+            if schema is not None:
+                limit = schema.max_body
+            else:
+                limit = self.app.config['BLUEPRINT_MAX_CONTENT_LENGTH'].get(
+                    blueprint, self.app.config['MAX_CONTENT_LENGTH'])
+            self._limits[endpoint] = limit
+        return limit
+
+    def _reject(self, status, message):
+        metrics.incr(f'requests.rejected.{status}')
+        return jsonify({'message': message}), status
+
+    def _check_body(self):
+        if request.method not in BODY_METHODS or request.endpoint is None:
+            return None
+
+        limit = self.limit_for(request.endpoint, request.blueprint)
+        request.max_content_length = limit
+
+        length = request.content_length
+        chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+        if not length and not chunked:
+            return None
+        if length is not None and limit is not None and length > limit:
+            return self._reject(413, 'Request body is too large')
+        if request.blueprint in self.app.config['JSON_ONLY_BLUEPRINTS'] and not request.is_json:
+            return self._reject(415, 'Content-Type must be application/json')
+        return None
+
+    def _too_large(self, error):
+        return self._reject(413, 'Request body is too large')
+
+
+request_limits = RequestLimits()
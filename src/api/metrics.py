@@ -0,0 +1,48 @@
+"""
+Métricas en memoria del proceso: contadores, tiempos y gauges calculados.
+
+Se exponen como JSON en /metrics (ver app.py). Cada worker de gunicorn tiene
+las suyas.
+"""
+import threading
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}  # nombre -> [cantidad, total, máximo] en segundos
+        self._gauges = {}  # nombre -> función sin argumentos
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def gauge(self, name, func):
+        """Registra un valor que se calcula al pedir el snapshot"""
+        self._gauges[name] = func
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {
+                name: {'count': count, 'avg_ms': round(total / count * 1000, 3),
+                       'max_ms': round(maximum * 1000, 3)}
+                for name, (count, total, maximum) in self._timings.items() if count
+            }
+        gauges = {name: func() for name, func in self._gauges.items()}
+        return {'counters': counters, 'timings': timings, 'gauges': gauges}
+
+
+metrics = Metrics()
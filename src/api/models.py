@@ -1,42 +1,121 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean
+from sqlalchemy import String, Boolean, BigInteger, DateTime, Float, ForeignKey, select
 from sqlalchemy.orm import Mapped, mapped_column
 from flask_bcrypt import Bcrypt
+from api.hashers import password_hashers
 import jwt
 from datetime import datetime, timedelta
 import os
+import threading
+import time
+import uuid
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+TOKEN_TTL = timedelta(hours=24)
+# "standard": claims legibles (user_id, email); "compact": claims cortos (u, e) sin typ
+TOKEN_PROFILES = ('standard', 'compact')
+# Segundos durante los que se reutiliza el mismo token en logins repetidos
+TOKEN_REUSE_WINDOW = int(os.environ.get('TOKEN_REUSE_WINDOW', 60))
+TOKEN_CACHE_MAX_SIZE = 10000
+
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+
+def forget_tokens(user_id):
+    """Descarta los tokens reutilizables de un usuario (p. ej. tras cerrar sus sesiones); None = todos"""
+    with _token_cache_lock:
+        if user_id is None:
+            _token_cache.clear()
+            return
+        for key in [k for k in _token_cache if k[0] == user_id]:
+            del _token_cache[key]
+
+DEFAULT_TENANT = 'default'
+
 class User(db.Model):
+    # El email es único por tenant; el índice (tenant_id, email) resuelve los logins.
+    # ix_user_email_prefix sirve a la búsqueda por prefijo del admin (LIKE 'abc%' en Postgres)
+    __table_args__ = (db.UniqueConstraint('tenant_id', 'email', name='uq_user_tenant_email'),
+                      db.Index('ix_user_email_prefix', 'email', postgresql_ops={'email': 'varchar_pattern_ops'}))
+
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str] = mapped_column(String(120), unique=True, nullable=False)
-    password: Mapped[str] = mapped_column(nullable=False)
+    tenant_id: Mapped[str] = mapped_column(String(64), nullable=False, default=DEFAULT_TENANT,
+                                           server_default=DEFAULT_TENANT)
+    email: Mapped[str] = mapped_column(String(120), nullable=False)
+    # Diferida: solo se carga cuando hace falta verificar la contraseña
+    password: Mapped[str] = mapped_column(nullable=False, deferred=True)
     is_active: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=True)
+    # Lo actualiza el audit log en diferido (un UPDATE por usuario y flush)
+    last_login_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
 
     def set_password(self, password):
-        """Encripta la contraseña usando bcrypt"""
-        self.password = bcrypt.generate_password_hash(password).decode('utf-8')
+        """Encripta la contraseña con el algoritmo preferido (argon2id o bcrypt)"""
+        self.password = password_hashers.hash(password)
     
     def check_password(self, password):
-        """Verifica si la contraseña es correcta"""
-        return bcrypt.check_password_hash(self.password, password)
-    
-    def generate_token(self):
-        """Genera un JWT token para el usuario"""
-        payload = {
-            'user_id': self.id,
-            'email': self.email,
-            'exp': datetime.utcnow() + timedelta(hours=24)  # Token expira en 24 horas
-        }
-        return jwt.encode(payload, os.environ.get('JWT_SECRET_KEY', 'default-secret-key'), algorithm='HS256')
+        """Verifica si la contraseña es correcta, sea cual sea el algoritmo del hash"""
+        return password_hashers.verify(self.password, password)
+
+    def password_needs_upgrade(self):
+        """True si el hash guardado no usa el algoritmo o los parámetros actuales"""
+        return password_hashers.needs_upgrade(self.password)
     
+    def generate_token(self, profile='standard', include_email=True):
+        """Genera un JWT token para el usuario, reutilizando uno reciente si existe"""
+        return self.issue_token(profile=profile, include_email=include_email)[0]
+
+    def issue_token(self, profile='standard', include_email=True, device=None):
+        """Genera un token y devuelve (token, jti, exp, reutilizado)"""
+        now = int(time.time())
+        cache_key = (self.id, self.email if include_email else None, profile, device)
+        cached = _token_cache.get(cache_key)
+        if cached is not None and now - cached[1] < TOKEN_REUSE_WINDOW:
+            token, _, jti, exp = cached
+            return token, jti, exp, True
+
+        jti = uuid.uuid4().hex
+        exp = now + int(TOKEN_TTL.total_seconds())  # Token expira en 24 horas
+        headers = None
+        if profile == 'compact':
+            payload = {'u': self.id, 'exp': exp, 'jti': jti}
+            if include_email:
+                payload['e'] = self.email
+            if self.tenant_id not in (None, DEFAULT_TENANT):
+                payload['t'] = self.tenant_id
+            headers = {'typ': None}  # El header queda en {"alg":"HS256"}
+        else:
+            payload = {'user_id': self.id, 'exp': exp, 'jti': jti}
+            if include_email:
+                payload['email'] = self.email
+            if self.tenant_id not in (None, DEFAULT_TENANT):
+                payload['tenant_id'] = self.tenant_id
+
+        token = jwt.encode(payload, os.environ.get('JWT_SECRET_KEY', 'default-secret-key'),
+                           algorithm='HS256', headers=headers)
+
+        with _token_cache_lock:
+            if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+                _token_cache.pop(next(iter(_token_cache)))
+            _token_cache[cache_key] = (token, now, jti, exp)
+        return token, jti, exp, False
+
     @staticmethod
     def verify_token(token):
         """Verifica y decodifica un JWT token"""
         try:
             payload = jwt.decode(token, os.environ.get('JWT_SECRET_KEY', 'default-secret-key'), algorithms=['HS256'])
+            # Normaliza los claims del perfil compacto a los nombres de siempre
+            if 'u' in payload:
+                payload.setdefault('user_id', payload['u'])
+            if 'e' in payload:
+                payload.setdefault('email', payload['e'])
+            if 't' in payload:
+                payload.setdefault('tenant_id', payload['t'])
+            # Los tokens sin tenant pertenecen al tenant por defecto
+            payload.setdefault('tenant_id', DEFAULT_TENANT)
             return payload
         except jwt.ExpiredSignatureError:
             return None  # Token expirado
@@ -46,7 +125,101 @@ class User(db.Model):
     def serialize(self):
         return {
             "id": self.id,
+            "tenant_id": self.tenant_id,
             "email": self.email,
             "is_active": self.is_active
             # do not serialize the password, its a security breach
-        }
\ No newline at end of file
+        }
+
+
+class UserPrincipal:
+    """Identidad ligera del usuario autenticado: sin ORM, sin sesión y sin password"""
+    __slots__ = ('id', 'tenant_id', 'email', 'is_active')
+
+    def __init__(self, id, tenant_id, email, is_active):
+        self.id = id
+        self.tenant_id = tenant_id
+        self.email = email
+        self.is_active = is_active
+
+    @staticmethod
+    def select():
+        """SELECT con solo las columnas necesarias; cada fila construye un UserPrincipal"""
+        return select(User.id, User.tenant_id, User.email, User.is_active)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "tenant_id": self.tenant_id,
+            "email": self.email,
+            "is_active": self.is_active
+        }
+
+
+class UserSession(db.Model):
+    """Registro de los tokens emitidos (una fila por jti)"""
+    __table_args__ = (db.Index('ix_user_session_tenant_id_user_id', 'tenant_id', 'user_id'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tenant_id: Mapped[str] = mapped_column(String(64), nullable=False, default=DEFAULT_TENANT,
+                                           server_default=DEFAULT_TENANT)
+    jti: Mapped[str] = mapped_column(String(32), unique=True, nullable=False)
+    user_id: Mapped[int] = mapped_column(ForeignKey('user.id'), index=True, nullable=False)
+    device: Mapped[str] = mapped_column(String(255), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(), nullable=False, default=datetime.utcnow)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(), index=True, nullable=False)
+    revoked: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
+    # Cursor para el refresco incremental del índice en memoria
+    updated_at: Mapped[datetime] = mapped_column(DateTime(), index=True, nullable=False, default=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            "jti": self.jti,
+            "device": self.device,
+            "created_at": self.created_at.isoformat(),
+            "expires_at": self.expires_at.isoformat(),
+            "revoked": self.revoked
+        }
+
+
+class AuditEvent(db.Model):
+    """Evento de auditoría (logins correctos y fallidos), escrito por lotes"""
+    __table_args__ = (db.Index('ix_audit_event_tenant_id_created_at', 'tenant_id', 'created_at'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tenant_id: Mapped[str] = mapped_column(String(64), nullable=False, default=DEFAULT_TENANT,
+                                           server_default=DEFAULT_TENANT)
+    event: Mapped[str] = mapped_column(String(32), nullable=False)
+    # Sin FK: un login fallido puede no tener usuario y el evento sobrevive al usuario
+    user_id: Mapped[int] = mapped_column(index=True, nullable=True)
+    email: Mapped[str] = mapped_column(String(120), nullable=True)
+    reason: Mapped[str] = mapped_column(String(32), nullable=True)
+    ip: Mapped[str] = mapped_column(String(45), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(), nullable=False, default=datetime.utcnow)
+
+    def serialize(self):
+        return {
+            "event": self.event,
+            "user_id": self.user_id,
+            "email": self.email,
+            "reason": self.reason,
+            "ip": self.ip,
+            "created_at": self.created_at.isoformat()
+        }
+
+
+class InvalidationEvent(db.Model):
+    """Aviso de cambio de un usuario para los workers que no pueden usar LISTEN/NOTIFY"""
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(nullable=False)
+    # Epoch del publicador, para medir la latencia de propagación
+    published_at: Mapped[float] = mapped_column(Float(), index=True, nullable=False)
+
+
+class BackfillCheckpoint(db.Model):
+    """Progreso de un backfill en línea (ver api/backfill.py)"""
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    last_key: Mapped[int] = mapped_column(BigInteger(), nullable=True)
+    rows: Mapped[int] = mapped_column(BigInteger(), nullable=False, default=0)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(), nullable=False, default=datetime.utcnow)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
@@ -0,0 +1,139 @@
+"""
+Enrutamiento de consultas de solo lectura hacia réplicas de la base de datos.
+
+Las réplicas se declaran como binds de Flask-SQLAlchemy con prefijo "replica_"
+(ver DATABASE_REPLICA_URLS en app.py). Las lecturas se reparten en round-robin
+entre las réplicas sanas; si una falla se marca caída durante un tiempo y la
+consulta pasa a la siguiente, terminando en la base primaria.
+
+Read-your-writes: tras una escritura (signup) la respuesta lleva la hora de
+la escritura en la cookie y el header X-Last-Write. Mientras el cliente la
+devuelva dentro de REPLICA_READ_YOUR_WRITES_WINDOW segundos, sus lecturas van
+a la primaria aunque caigan en otro worker u otra instancia. El registro en
+memoria del proceso se mantiene para los clientes que no la devuelven.
+"""
+import itertools
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from api.models import db
+
+REPLICA_BIND_PREFIX = 'replica_'
+LAST_WRITE_HEADER = 'X-Last-Write'
+
+
+class ReplicaRouter:
+
+    def __init__(self, app=None):
+        self.bind_keys = []
+        self.failover_cooldown = 30
+        self.read_your_writes_window = 5
+        self.cookie_name = 'last_write'
+        self._cycle = None
+        self._lock = threading.Lock()
+        self._down_until = {}
+        self._recent_writes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REPLICA_FAILOVER_COOLDOWN', 30)
+        app.config.setdefault('REPLICA_READ_YOUR_WRITES_WINDOW', 5)
+        app.config.setdefault('REPLICA_LAST_WRITE_COOKIE', 'last_write')
+        self.failover_cooldown = app.config['REPLICA_FAILOVER_COOLDOWN']
+        self.read_your_writes_window = app.config['REPLICA_READ_YOUR_WRITES_WINDOW']
+        self.cookie_name = app.config['REPLICA_LAST_WRITE_COOKIE']
+
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        self.bind_keys = sorted(k for k in binds if k.startswith(REPLICA_BIND_PREFIX))
+        self._cycle = itertools.cycle(self.bind_keys) if self.bind_keys else None
+        app.extensions['replica_router'] = self
+        app.after_request(self._after_request)
+
+    def mark_written(self, *keys):
+        """Fuerza que las lecturas de estas claves vayan a la primaria por un tiempo"""
+        if not self.bind_keys:
+            return
+        if has_request_context():
+            # Viaja con el cliente (ver _after_request): vale en cualquier worker
+            g.replica_last_write = time.time()
+        now = time.monotonic()
+        expires = now + self.read_your_writes_window
+        with self._lock:
+            # Limpieza perezosa para que el diccionario no crezca sin límite
+            for key in [k for k, t in self._recent_writes.items() if t <= now]:
+                del self._recent_writes[key]
+            for key in keys:
+                self._recent_writes[key] = expires
+
+    def is_sticky(self, key):
+        """Indica si la clave se escribió hace poco y debe leerse de la primaria"""
+        if key is None:
+            return False
+        if self._client_wrote_recently():
+            return True
+        expires = self._recent_writes.get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def _client_wrote_recently(self):
+        """El cliente trae la hora de una escritura suya dentro de la ventana"""
+        if not has_request_context():
+            return False
+        value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(self.cookie_name)
+        try:
+            written_at = float(value)
+        except (TypeError, ValueError):
+            return False
+        # Hora de pared: se compara entre hosts, así que se tolera un poco de desfase hacia adelante
+        age = time.time() - written_at
+        return -1 <= age < self.read_your_writes_window
+
+    def _after_request(self, response):
+        written_at = g.pop('replica_last_write', None)
+        if written_at is not None:
+            value = f'{written_at:.3f}'
+            response.headers[LAST_WRITE_HEADER] = value
+            response.set_cookie(self.cookie_name, value, max_age=max(int(self.read_your_writes_window), 1),
+                                httponly=True, samesite='Lax', secure=request.is_secure)
+        return response
+
+    def mark_down(self, bind_key):
+        with self._lock:
+            self._down_until[bind_key] = time.monotonic() + self.failover_cooldown
+
+    def healthy_binds(self):
+        """Réplicas sanas en orden round-robin a partir de la siguiente en turno"""
+        if self._cycle is None:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            start = next(self._cycle)
+        index = self.bind_keys.index(start)
+        ordered = self.bind_keys[index:] + self.bind_keys[:index]
+        return [k for k in ordered if self._down_until.get(k, 0) <= now]
+
+    def execute(self, statement, sticky_key=None):
+        """Ejecuta una consulta de solo lectura en una réplica con failover a la primaria"""
+        if self.is_sticky(sticky_key):
+            return db.session.execute(statement)
+
+        for bind_key in self.healthy_binds():
+            try:
+                return db.session.execute(
+                    statement, bind_arguments={'bind': db.engines[bind_key]})
+            except OperationalError:
+                db.session.rollback()
+                self.mark_down(bind_key)
+
+        return db.session.execute(statement)
+
+    def get(self, model, ident, sticky_key=None):
+        """Equivalente de solo lectura a Model.query.get"""
+        return self.execute(
+            select(model).where(model.id == ident), sticky_key=sticky_key
+        ).scalar_one_or_none()
+
+
+replica_router = ReplicaRouter()
@@ -1,26 +1,44 @@
 """
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
-from flask import Flask, request, jsonify, url_for, Blueprint
-from api.models import db, User
+from flask import Flask, request, jsonify, url_for, Blueprint, current_app, g
+from api.models import db, User, UserPrincipal, UserSession
+from api.replicas import replica_router
+from api.sessions import session_registry
+from api.idempotency import idempotent
+from api.singleflight import SingleFlight
+from api.tenants import resolve_tenant
+from api.shared_cache import token_cache
+from api.audit import audit_log
+from api.write_queue import signup_writer
+from api.sqlite_tuning import sqlite_profile
+from api.schemas import use_schema, SIGNUP_SCHEMA, LOGIN_SCHEMA, VERIFY_BATCH_SCHEMA
 from api.utils import generate_sitemap, APIException
-from flask_cors import CORS
 from functools import wraps
-import re
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer
 
 api = Blueprint('api', __name__)
 
-# Allow CORS requests to this API
-CORS(api)
+# Agrupa verificaciones de token y lecturas de usuario concurrentes e idénticas
+token_flight = SingleFlight('verify_token')
+user_flight = SingleFlight('user_lookup')
 
-def validate_email(email):
-    """Valida el formato del email"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+def verify_token_coalesced(token):
+    """User.verify_token compartiendo el resultado entre hilos con el mismo token"""
+    payload, shared = token_flight.do(token, lambda: User.verify_token(token))
+    return dict(payload) if shared and payload is not None else payload
 
-def validate_password(password):
-    """Valida que la contraseña tenga al menos 6 caracteres"""
-    return len(password) >= 6
+def load_principal(user_id, tenant_id):
+    """Lee id, tenant, email e is_active del usuario (réplica si hay) como UserPrincipal"""
+    def fetch():
+        row = replica_router.execute(
+            UserPrincipal.select().where(User.id == user_id, User.tenant_id == tenant_id),
+            sticky_key=f"user:{user_id}").first()
+        return UserPrincipal(*row) if row is not None else None
+    # El UserPrincipal no pertenece a ninguna sesión, así que se comparte tal cual
+    return user_flight.do((tenant_id, user_id), fetch)[0]
 
 def token_required(f):
     """Decorador para validar JWT token en rutas protegidas"""
@@ -29,6 +47,7 @@ def token_required(f):
         token = request.headers.get('Authorization')
         
         if not token:
+            g.auth_failure = 'missing_token'
             return jsonify({'message': 'Token is missing'}), 401
         
         try:
@@ -36,15 +55,54 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             
-            payload = User.verify_token(token)
-            if payload is None:
-                return jsonify({'message': 'Token is invalid or expired'}), 401
+            # Caché compartida entre workers: evita JWT y base de datos. La sesión se comprueba
+            # igual (es una consulta al índice en memoria) para respetar revocaciones de otros hosts
+            cached = token_cache.get(token)
+            if cached is not None:
+                payload = cached['payload']
+                current_user = UserPrincipal(*cached['user'])
+                if 'jti' in payload and not session_registry.is_active(payload['jti']):
+                    token_cache.delete(token)
+                    g.auth_failure = 'revoked_session'
+                    return jsonify({'message': 'Session has been revoked'}), 401
+                if resolve_tenant(payload) != current_user.tenant_id:
+                    g.auth_failure = 'tenant_mismatch'
+                    return jsonify({'message': 'Token does not belong to this tenant'}), 401
+            else:
+                payload = verify_token_coalesced(token)
+                if payload is None:
+                    g.auth_failure = 'invalid_token'
+                    return jsonify({'message': 'Token is invalid or expired'}), 401
+                # Antes de leer sesión y usuario: una invalidación de aquí en adelante descarta la entrada
+                generation = token_cache.generation(payload['user_id'])
+                
+                # Los tokens sin jti son anteriores al registro de sesiones
+                if 'jti' in payload and not session_registry.is_active(payload['jti']):
+                    g.auth_failure = 'revoked_session'
+                    return jsonify({'message': 'Session has been revoked'}), 401
+                
+                tenant_id = resolve_tenant(payload)
+                if tenant_id is None:
+                    g.auth_failure = 'tenant_mismatch'
+                    return jsonify({'message': 'Token does not belong to this tenant'}), 401
+                
+                current_user = load_principal(payload['user_id'], tenant_id)
+                if not current_user or not current_user.is_active:
+                    g.auth_failure = 'inactive_user'
+                    return jsonify({'message': 'User not found or inactive'}), 401
+                
+                token_cache.set(token, {
+                    'payload': payload,
+                    'user': [current_user.id, current_user.tenant_id, current_user.email, current_user.is_active],
+                }, current_user.id, payload['exp'], generation)
             
-            current_user = User.query.get(payload['user_id'])
-            if not current_user or not current_user.is_active:
-                return jsonify({'message': 'User not found or inactive'}), 401
+            g.token = token
+            g.token_payload = payload
+            g.current_user_id = current_user.id
                 
         except Exception as e:
+            g.auth_failure = 'error'
+            current_app.logger.exception('Token validation failed')
             return jsonify({'message': 'Token is invalid'}), 401
         
         return f(current_user, *args, **kwargs)
@@ -52,38 +110,33 @@ def token_required(f):
     return decorated
 
 @api.route('/signup', methods=['POST'])
-def signup():
+@idempotent
+@use_schema(SIGNUP_SCHEMA)
+def signup(data):
     """Registro de nuevos usuarios"""
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'message': 'No data provided'}), 400
-        
-        email = data.get('email', '').strip().lower()
-        password = data.get('password', '')
-        
-        # Validaciones
-        if not email or not password:
-            return jsonify({'message': 'Email and password are required'}), 400
+        email = data['email']
+        password = data['password']
         
-        if not validate_email(email):
-            return jsonify({'message': 'Invalid email format'}), 400
+        tenant_id = resolve_tenant()
         
-        if not validate_password(password):
-            return jsonify({'message': 'Password must be at least 6 characters long'}), 400
-        
-        # Verificar si el usuario ya existe
-        existing_user = User.query.filter_by(email=email).first()
-        if existing_user:
+        # Verificar si el usuario ya existe en este tenant
+        existing_user = db.session.scalar(select(User.id).filter_by(tenant_id=tenant_id, email=email))
+        if existing_user is not None:
             return jsonify({'message': 'User already exists with this email'}), 409
         
-        # Crear nuevo usuario
-        new_user = User(email=email)
+        # Crear nuevo usuario: el hash se calcula aquí y solo el INSERT pasa por la cola de escritura
+        new_user = User(tenant_id=tenant_id, email=email, is_active=True)
         new_user.set_password(password)
-        
-        db.session.add(new_user)
-        db.session.commit()
+        try:
+            new_user.id = signup_writer.submit(lambda: db.session.scalar(
+                insert(User).values(tenant_id=tenant_id, email=email, password=new_user.password)
+                .returning(User.id)))
+        except IntegrityError:
+            # Otro signup con el mismo email ganó la carrera
+            return jsonify({'message': 'User already exists with this email'}), 409
+        # Read-your-writes: las siguientes lecturas de este usuario van a la primaria
+        replica_router.mark_written(f"email:{tenant_id}:{email}", f"user:{new_user.id}")
         
         return jsonify({
             'message': 'User created successfully',
@@ -92,34 +145,49 @@ def signup():
         
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Signup failed')
         return jsonify({'message': 'Internal server error'}), 500
 
 @api.route('/login', methods=['POST'])
-def login():
+@use_schema(LOGIN_SCHEMA)
+def login(data):
     """Inicio de sesión de usuarios"""
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'message': 'No data provided'}), 400
-        
-        email = data.get('email', '').strip().lower()
-        password = data.get('password', '')
-        
-        if not email or not password:
-            return jsonify({'message': 'Email and password are required'}), 400
+        email = data['email']
+        password = data['password']
         
-        # Buscar usuario
-        user = User.query.filter_by(email=email).first()
+        # Buscar usuario en el tenant del host (en una réplica si hay configuradas)
+        tenant_id = resolve_tenant()
+        user = replica_router.execute(
+            select(User).options(undefer(User.password)).filter_by(tenant_id=tenant_id, email=email),
+            sticky_key=f"email:{tenant_id}:{email}"
+        ).scalar_one_or_none()
         
         if not user or not user.check_password(password):
+            g.auth_failure = 'bad_credentials'
+            audit_log.record('login.failure', user_id=user.id if user else None, email=email,
+                             reason=g.auth_failure, tenant_id=tenant_id)
             return jsonify({'message': 'Invalid email or password'}), 401
         
         if not user.is_active:
+            g.auth_failure = 'inactive_user'
+            audit_log.record('login.failure', user_id=user.id, email=email,
+                             reason=g.auth_failure, tenant_id=tenant_id)
             return jsonify({'message': 'Account is deactivated'}), 401
         
+        # Migración transparente del hash al algoritmo preferido
+        if user.password_needs_upgrade():
+            sqlite_profile.begin_write(db.session)
+            user.set_password(password)
+            db.session.commit()
+        
         # Generar token
-        token = user.generate_token()
+        g.current_user_id = user.id
+        device = (data['device'] or request.headers.get('User-Agent') or '')[:255] or None
+        token = session_registry.open(user, device=device, profile=data['token_profile'],
+                                      include_email=not data['omit_email'])
+        audit_log.record('login.success', user_id=user.id, email=email, tenant_id=tenant_id,
+                         touch_login=True)
         
         return jsonify({
             'message': 'Login successful',
@@ -128,6 +196,7 @@ def login():
         }), 200
         
     except Exception as e:
+        current_app.logger.exception('Login failed')
         return jsonify({'message': 'Internal server error'}), 500
 
 @api.route('/validate-token', methods=['GET'])
@@ -139,6 +208,50 @@ def validate_token(current_user):
         'user': current_user.serialize()
     }), 200
 
+@api.route('/tokens/verify-batch', methods=['POST'])
+@use_schema(VERIFY_BATCH_SCHEMA)
+def verify_token_batch(data):
+    """Valida varios tokens con una sola consulta de usuarios (pensado para gateways)"""
+    tokens = data['tokens']
+
+    max_tokens = current_app.config.get('TOKEN_VERIFY_BATCH_MAX', 100)
+    if len(tokens) > max_tokens:
+        return jsonify({'message': f'At most {max_tokens} tokens per batch'}), 400
+
+    payloads = []
+    for token in tokens:
+        if isinstance(token, str) and token.startswith('Bearer '):
+            token = token[7:]
+        payloads.append(User.verify_token(token) if isinstance(token, str) and token else None)
+
+    # Un único SELECT ... WHERE id IN (...) con los usuarios sin repetir
+    user_ids = {payload['user_id'] for payload in payloads if payload and 'user_id' in payload}
+    users = {}
+    if user_ids:
+        users = {
+            row.id: UserPrincipal(*row)
+            for row in replica_router.execute(UserPrincipal.select().where(User.id.in_(user_ids)))
+        }
+
+    results = []
+    for payload in payloads:
+        if payload is None:
+            results.append({'valid': False, 'message': 'Token is invalid or expired'})
+            continue
+        if 'jti' in payload and not session_registry.is_active(payload['jti']):
+            results.append({'valid': False, 'message': 'Session has been revoked'})
+            continue
+        user = users.get(payload.get('user_id'))
+        if user is not None and user.tenant_id != resolve_tenant(payload):
+            results.append({'valid': False, 'message': 'Token does not belong to this tenant'})
+            continue
+        if not user or not user.is_active:
+            results.append({'valid': False, 'message': 'User not found or inactive'})
+            continue
+        results.append({'valid': True, 'user': user.serialize()})
+
+    return jsonify({'results': results}), 200
+
 @api.route('/profile', methods=['GET'])
 @token_required
 def get_profile(current_user):
@@ -147,6 +260,35 @@ def get_profile(current_user):
         'user': current_user.serialize()
     }), 200
 
+@api.route('/sessions', methods=['GET'])
+@token_required
+def list_sessions(current_user):
+    """Lista las sesiones activas del usuario autenticado"""
+    jtis = session_registry.active_jtis(current_user.id)
+    sessions = []
+    if jtis:
+        sessions = db.session.execute(
+            select(UserSession).where(UserSession.jti.in_(jtis)).order_by(UserSession.created_at)
+        ).scalars()
+    return jsonify({'sessions': [session.serialize() for session in sessions]}), 200
+
+@api.route('/logout', methods=['POST'])
+@token_required
+def logout(current_user):
+    """Cierra la sesión del token actual"""
+    jti = g.token_payload.get('jti')
+    if jti:
+        session_registry.revoke([jti])
+    token_cache.delete(g.token)
+    return jsonify({'message': 'Logged out'}), 200
+
+@api.route('/logout-all', methods=['POST'])
+@token_required
+def logout_all(current_user):
+    """Cierra todas las sesiones del usuario en todos los dispositivos"""
+    revoked = session_registry.revoke_user(current_user.id)
+    return jsonify({'message': 'Logged out everywhere', 'revoked': revoked}), 200
+
 @api.route('/hello', methods=['POST', 'GET'])
 def handle_hello():
     response_body = {
@@ -0,0 +1,213 @@
+"""
+Planificador ligero para tareas periódicas de mantenimiento (limpieza de
+sesiones, refresco de cachés, estadísticas...).
+
+Puede correr dentro de cada worker de gunicorn (SCHEDULER_ENABLED=1, ver
+wsgi.py) o como proceso aparte con `flask run-scheduler`. Las tareas marcadas
+como leader_only solo se ejecutan en el proceso que tenga el lock de líder:
+un advisory lock de Postgres o, en otras bases, un file lock local.
+"""
+import fcntl
+import random
+import threading
+import time
+import zlib
+from sqlalchemy import text
+from api.models import db
+
+# Clave del advisory lock de Postgres, estable entre procesos
+ADVISORY_LOCK_KEY = zlib.crc32(b'jwt-auth-api-scheduler')
+
+
+class LeaderLock:
+    """Lock de líder no bloqueante; se intenta adquirir en cada vuelta del planificador"""
+
+    def __init__(self, lock_file):
+        self.lock_file = lock_file
+        self._connection = None
+        self._file = None
+
+    @property
+    def held(self):
+        return self._connection is not None or self._file is not None
+
+    def acquire(self):
+        if self._connection is not None:
+            # Si la sesión de Postgres se cayó el servidor ya soltó el lock: se verifica
+            # cada tick y, si no responde, se descarta y se vuelve a elegir líder
+            try:
+                self._connection.execute(text('SELECT 1'))
+                self._connection.commit()
+                return True
+            except Exception:
+                self._discard_connection()
+        if self._file is not None:
+            return True
+        if db.engine.dialect.name == 'postgresql':
+            connection = db.engine.connect()
+            try:
+                acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'),
+                                              {'key': ADVISORY_LOCK_KEY}).scalar()
+            except Exception:
+                connection.close()
+                raise
+            if acquired:
+                # La conexión queda abierta: el lock vive mientras viva la sesión.
+                # Sin transacción abierta, para no caer en idle_in_transaction_session_timeout
+                connection.commit()
+                self._connection = connection
+                return True
+            connection.close()
+            return False
+
+        lock = open(self.lock_file, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._file = lock
+        return True
+
+    def _discard_connection(self):
+        connection, self._connection = self._connection, None
+        try:
+            connection.invalidate()
+        except Exception:
+            pass
+
+    def release(self):
+        if self._connection is not None:
+            try:
+                self._connection.execute(text('SELECT pg_advisory_unlock(:key)'),
+                                         {'key': ADVISORY_LOCK_KEY})
+                self._connection.commit()
+            except Exception:
+                # La sesión ya no existe y con ella el lock
+                self._discard_connection()
+            else:
+                self._connection.close()
+                self._connection = None
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class Job:
+
+    def __init__(self, name, func, interval, jitter, leader_only):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.leader_only = leader_only
+        self.next_run = 0.0
+        self.last_duration = None
+        self.runs = 0
+        self.failures = 0
+
+    def schedule_next(self, now):
+        self.next_run = now + self.interval + random.uniform(0, self.jitter * self.interval)
+
+
+class Scheduler:
+
+    def __init__(self):
+        self.jobs = {}
+        self.stats = {}
+        self.app = None
+        self.lock = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def job(self, name, interval, jitter=0.1, leader_only=True):
+        """Decorador para registrar una tarea periódica (interval en segundos)"""
+        def decorator(func):
+            self.jobs[name] = Job(name, func, interval, jitter, leader_only)
+            return func
+        return decorator
+
+    def init_app(self, app):
+        app.config.setdefault('SCHEDULER_LOCK_FILE', '/tmp/jwt-auth-scheduler.lock')
+        app.config.setdefault('SCHEDULER_TICK', 1.0)
+        self.app = app
+        self.lock = LeaderLock(app.config['SCHEDULER_LOCK_FILE'])
+        app.extensions['scheduler'] = self
+
+    def run_pending(self):
+        """Ejecuta las tareas vencidas; devuelve cuántas se ejecutaron"""
+        now = time.monotonic()
+        due = [job for job in self.jobs.values() if job.next_run <= now]
+        if not due:
+            return 0
+
+        with self.app.app_context():
+            is_leader = False
+            if any(job.leader_only for job in due):
+                try:
+                    is_leader = self.lock.acquire()
+                except Exception:
+                    # Error transitorio (p. ej. la base no responde): las tareas de líder siguen
+                    # vencidas y se reintenta en el próximo tick
+                    self.app.logger.exception("Scheduler leader election failed")
+                    due = [job for job in due if not job.leader_only]
+            executed = 0
+            for job in due:
+                job.schedule_next(now)
+                if job.leader_only and not is_leader:
+                    continue
+                started = time.perf_counter()
+                try:
+                    job.func()
+                    job.runs += 1
+                except Exception:
+                    job.failures += 1
+                    db.session.rollback()
+                    self.app.logger.exception("Scheduled job %s failed", job.name)
+                finally:
+                    job.last_duration = time.perf_counter() - started
+                    db.session.remove()
+                executed += 1
+        return executed
+
+    def run_forever(self):
+        # Arranque escalonado para que los workers no coincidan en el primer tick
+        for job in self.jobs.values():
+            job.next_run = time.monotonic() + random.uniform(0, job.jitter * job.interval)
+        try:
+            while not self._stop.wait(self.app.config['SCHEDULER_TICK']):
+                try:
+                    self.run_pending()
+                except Exception:
+                    # Un tick fallido no debe matar el hilo
+                    self.app.logger.exception("Scheduler tick failed")
+        finally:
+            self.lock.release()
+
+    def start(self):
+        """Arranca el planificador en un hilo daemon dentro del proceso actual"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self):
+        return {
+            'leader': self.lock.held if self.lock else False,
+            'jobs': {
+                job.name: {'runs': job.runs, 'failures': job.failures,
+                           'last_duration': job.last_duration}
+                for job in self.jobs.values()
+            }
+        }
+
+
+scheduler = Scheduler()
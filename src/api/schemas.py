@@ -0,0 +1,184 @@
+"""
+Esquemas declarativos para los cuerpos JSON de las rutas del blueprint.
+
+Los validadores (regex incluidas) se compilan una sola vez al importar el
+módulo. El decorador use_schema rechaza cuerpos demasiado grandes antes de
+parsear el JSON y devuelve siempre el mismo formato de error 400:
+{"message": ..., "errors": {campo: mensaje}}. Los mismos esquemas alimentan
+la especificación de flask_swagger (ver swagger_template).
+"""
+import re
+from functools import wraps
+from flask import jsonify, request
+from api.models import TOKEN_PROFILES
+
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+_SWAGGER_TYPES = {str: 'string', bool: 'boolean', int: 'integer', list: 'array', dict: 'object'}
+
+
+class Field:
+
+    def __init__(self, name, type=str, required=False, default=None, normalize=None,
+                 min_length=None, max_length=None, pattern=None, choices=None,
+                 required_message=None, message=None):
+        self.name = name
+        self.type = type
+        self.required = required
+        self.default = default
+        self.normalize = normalize
+        self.min_length = min_length
+        self.max_length = max_length
+        self.pattern = pattern
+        self.choices = choices
+        self.required_message = required_message or f'{name} is required'
+        self.message = message or f'Invalid {name}'
+
+    def check(self, value):
+        """Devuelve el mensaje de error del valor, o None si es válido"""
+        if not isinstance(value, self.type) or (self.type is int and isinstance(value, bool)):
+            return self.message
+        if self.min_length is not None and len(value) < self.min_length:
+            return self.message
+        if self.max_length is not None and len(value) > self.max_length:
+            return self.message
+        if self.pattern is not None and self.pattern.match(value) is None:
+            return self.message
+        if self.choices is not None and value not in self.choices:
+            return self.message
+        return None
+
+    def to_swagger(self):
+        prop = {'type': _SWAGGER_TYPES[self.type]}
+        if self.min_length is not None:
+            prop['minItems' if self.type is list else 'minLength'] = self.min_length
+        if self.max_length is not None:
+            prop['maxItems' if self.type is list else 'maxLength'] = self.max_length
+        if self.pattern is not None:
+            prop['pattern'] = self.pattern.pattern
+        if self.choices is not None:
+            prop['enum'] = list(self.choices)
+        if self.default is not None:
+            prop['default'] = self.default
+        if self.type is list:
+            prop['items'] = {'type': 'string'}
+        return prop
+
+
+class Schema:
+
+    def __init__(self, name, fields, max_body=4096):
+        self.name = name
+        self.fields = fields
+        self.max_body = max_body
+
+    def validate(self, data):
+        """Devuelve (valores limpios, errores); los obligatorios se revisan primero"""
+        values = {}
+        errors = {}
+        for field in self.fields:
+            value = data.get(field.name)
+            if field.normalize is not None and isinstance(value, field.type):
+                value = field.normalize(value)
+            if field.required and (value is None or value == '' or value == []):
+                errors[field.name] = field.required_message
+            values[field.name] = value
+        if errors:
+            return None, errors
+
+        for field in self.fields:
+            value = values[field.name]
+            if value is None:
+                values[field.name] = field.default
+                continue
+            error = field.check(value)
+            if error is not None:
+                errors[field.name] = error
+        return (None, errors) if errors else (values, None)
+
+    def to_swagger(self):
+        return {
+            'type': 'object',
+            'required': [field.name for field in self.fields if field.required],
+            'properties': {field.name: field.to_swagger() for field in self.fields},
+        }
+
+
+def _clean_email(value):
+    return value.strip().lower()
+
+
+SIGNUP_SCHEMA = Schema('Signup', [
+    Field('email', required=True, normalize=_clean_email, max_length=120, pattern=EMAIL_PATTERN,
+          required_message='Email and password are required', message='Invalid email format'),
+    Field('password', required=True, min_length=6,
+          required_message='Email and password are required',
+          message='Password must be at least 6 characters long'),
+])
+
+LOGIN_SCHEMA = Schema('Login', [
+    Field('email', required=True, normalize=_clean_email, max_length=120,
+          required_message='Email and password are required', message='Invalid email or password'),
+    Field('password', required=True,
+          required_message='Email and password are required', message='Invalid email or password'),
+    Field('token_profile', default='standard', choices=TOKEN_PROFILES, message='Invalid token profile'),
+    Field('omit_email', type=bool, default=False),
+    Field('device', max_length=255),
+])
+
+VERIFY_BATCH_SCHEMA = Schema('VerifyTokenBatch', [
+    Field('tokens', type=list, required=True, min_length=1,
+          required_message='A non-empty list of tokens is required',
+          message='A non-empty list of tokens is required'),
+], max_body=256 * 1024)
+
+
+def use_schema(schema):
+    """Decorador: valida el cuerpo JSON y pasa los valores limpios como primer argumento"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Antes de leer el cuerpo: no se parsean JSON enormes para luego rechazarlos
+            if request.content_length is not None and request.content_length > schema.max_body:
+                return jsonify({'message': 'Request body is too large'}), 413
+
+            if request.content_length is None and request.max_content_length is not None:
+                # Cuerpo chunked: Werkzeug corta la lectura en el límite sin avisar,
+                # así que se intenta leer un byte más para que salte el 413
+                request.get_data()
+                request.stream.read(1)
+
+            data = request.get_json(silent=True)
+            if not data or not isinstance(data, dict):
+                return jsonify({'message': 'No data provided'}), 400
+
+            values, errors = schema.validate(data)
+            if errors:
+                return jsonify({'message': next(iter(errors.values())), 'errors': errors}), 400
+            return f(values, *args, **kwargs)
+
+        decorated.request_schema = schema
+        return decorated
+    return decorator
+
+
+def swagger_template(app):
+    """Paths y definitions de las rutas con esquema, como template de flask_swagger"""
+    paths = {}
+    definitions = {}
+    for rule in app.url_map.iter_rules():
+        schema = getattr(app.view_functions[rule.endpoint], 'request_schema', None)
+        if schema is None:
+            continue
+        definitions[schema.name] = schema.to_swagger()
+        paths.setdefault(rule.rule, {})['post'] = {
+            'summary': (app.view_functions[rule.endpoint].__doc__ or '').strip(),
+            'consumes': ['application/json'],
+            'parameters': [{'in': 'body', 'name': 'body', 'required': True,
+                            'schema': {'$ref': f'#/definitions/{schema.name}'}}],
+            'responses': {
+                '400': {'description': 'Validation error'},
+                '413': {'description': 'Request body is too large'},
+            },
+        }
+    return {'paths': paths, 'definitions': definitions}
@@ -0,0 +1,236 @@
+"""
+Registro de sesiones activas: cada token emitido queda guardado en la tabla
+user_session con su jti, dispositivo y expiración.
+
+Las comprobaciones por request se resuelven contra un índice en memoria que se
+refresca de forma incremental (solo filas con updated_at posterior al último
+refresco), así que no hay una consulta por request. Un jti que no está en el
+índice (emitido en otro worker después del último refresco) se busca por su
+fila; los que no existen se recuerdan un rato para no repetir la consulta.
+
+Las sesiones revocadas se conservan SESSION_REVOKED_RETENTION segundos antes
+de que sweep() las borre: el refresco incremental solo ve filas que existen.
+Un worker cuyo último refresco es más viejo que eso recarga el índice entero.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update, delete, and_, or_
+from api.models import db, UserSession, forget_tokens
+from api.shared_cache import token_cache
+from api.sqlite_tuning import sqlite_profile
+
+# Margen para no perder filas confirmadas con un updated_at algo anterior al cursor
+REFRESH_OVERLAP = timedelta(seconds=2)
+# jti desconocidos que se consultaron y no existen (o ya no valen): se recuerdan un rato
+NEGATIVE_CACHE_TTL = 30
+NEGATIVE_CACHE_MAX = 10000
+
+
+def _epoch(value):
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class SessionRegistry:
+
+    def __init__(self, app=None):
+        self.refresh_interval = 5
+        self.max_sessions_per_user = 5
+        self.revoked_retention = 3600
+        self._lock = threading.RLock()
+        self._sessions = {}  # jti -> (user_id, created_at, expires_at) en epoch
+        self._by_user = {}  # user_id -> set de jti
+        self._expiry = []  # heap de (expires_at, jti) para podar las caducadas sin recorrer todo
+        self._cursor = None
+        self._last_refresh = 0.0
+        self._missing = {}  # jti -> monotonic hasta el que se da por inexistente
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SESSION_INDEX_REFRESH_INTERVAL', 5)
+        app.config.setdefault('MAX_SESSIONS_PER_USER', 5)
+        app.config.setdefault('SESSION_REVOKED_RETENTION', 3600)
+        self.refresh_interval = app.config['SESSION_INDEX_REFRESH_INTERVAL']
+        self.max_sessions_per_user = app.config['MAX_SESSIONS_PER_USER']
+        self.revoked_retention = app.config['SESSION_REVOKED_RETENTION']
+        app.extensions['session_registry'] = self
+
+    def _apply(self, jti, user_id, created_at, expires_at, revoked):
+        expires = _epoch(expires_at)
+        if revoked or expires <= time.time():
+            self._drop(jti)
+        elif jti not in self._sessions:
+            self._sessions[jti] = (user_id, _epoch(created_at), expires)
+            self._by_user.setdefault(user_id, set()).add(jti)
+            heapq.heappush(self._expiry, (expires, jti))
+
+    def _drop(self, jti):
+        entry = self._sessions.pop(jti, None)
+        if entry is not None:
+            jtis = self._by_user.get(entry[0])
+            if jtis is not None:
+                jtis.discard(jti)
+                if not jtis:
+                    del self._by_user[entry[0]]
+
+    def _prune(self):
+        """Quita del índice las sesiones caducadas (las revocadas salen al verse la revocación)"""
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, jti = heapq.heappop(self._expiry)
+            self._drop(jti)
+
+    def refresh(self, force=False):
+        """Trae al índice las sesiones creadas o revocadas desde el último refresco"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval:
+            return
+
+        started = datetime.utcnow()
+        query = select(UserSession.jti, UserSession.user_id, UserSession.created_at,
+                       UserSession.expires_at, UserSession.revoked)
+        # Si el cursor es anterior a lo que sweep() conserva de las revocadas, pudo perderse alguna
+        full = self._cursor is None or \
+            started - self._cursor > timedelta(seconds=self.revoked_retention / 2)
+        if full:
+            query = query.where(UserSession.revoked == False, UserSession.expires_at > started)
+        else:
+            query = query.where(UserSession.updated_at >= self._cursor - REFRESH_OVERLAP)
+        rows = db.session.execute(query).all()
+
+        with self._lock:
+            if full:
+                self._sessions, self._by_user, self._expiry = {}, {}, []
+            for row in rows:
+                self._apply(*row)
+            self._prune()
+            self._cursor = started
+            self._last_refresh = now
+
+    def is_active(self, jti):
+        """Indica si el jti pertenece a una sesión vigente y no revocada"""
+        self.refresh()
+        entry = self._sessions.get(jti)
+        if entry is None:
+            # Puede haberse creado en otro worker después del último refresco: se busca esa fila
+            entry = self._lookup(jti)
+        return entry is not None and entry[2] > time.time()
+
+    def _lookup(self, jti):
+        """Lee una sola sesión por jti (índice único) y la incorpora al índice"""
+        now = time.monotonic()
+        if self._missing.get(jti, 0) > now:
+            return None
+        row = db.session.execute(
+            select(UserSession.jti, UserSession.user_id, UserSession.created_at,
+                   UserSession.expires_at, UserSession.revoked)
+            .where(UserSession.jti == jti)).first()
+        with self._lock:
+            if row is not None:
+                self._apply(*row)
+            entry = self._sessions.get(jti)
+            if entry is None:
+                if len(self._missing) >= NEGATIVE_CACHE_MAX:
+                    self._missing = {k: t for k, t in self._missing.items() if t > now}
+                    if len(self._missing) >= NEGATIVE_CACHE_MAX:
+                        self._missing.clear()
+                self._missing[jti] = now + NEGATIVE_CACHE_TTL
+        return entry
+
+    def active_jtis(self, user_id):
+        """jti de las sesiones vigentes del usuario, de la más antigua a la más nueva"""
+        self.refresh()
+        now = time.time()
+        with self._lock:
+            sessions = [(self._sessions[jti][1], jti) for jti in self._by_user.get(user_id, ())
+                        if self._sessions[jti][2] > now]
+        return [jti for _, jti in sorted(sessions)]
+
+    def open(self, user, device=None, profile='standard', include_email=True):
+        """Emite (o reutiliza) un token para el usuario y registra su sesión"""
+        token, jti, exp, reused = user.issue_token(profile, include_email, device)
+        if reused:
+            if self.is_active(jti):
+                return token
+            # El token cacheado pertenece a una sesión ya revocada
+            forget_tokens(user.id)
+            token, jti, exp, reused = user.issue_token(profile, include_email, device)
+
+        # El tope de sesiones se decide ya con el lock de escritura tomado
+        sqlite_profile.begin_write(db.session)
+        active = self.active_jtis(user.id)
+        overflow = len(active) - self.max_sessions_per_user + 1
+        if overflow > 0:
+            self.revoke(active[:overflow], commit=False)
+
+        now = datetime.utcnow()
+        session = UserSession(jti=jti, user_id=user.id, tenant_id=user.tenant_id, device=device,
+                              created_at=now, updated_at=now,
+                              expires_at=datetime.utcfromtimestamp(exp))
+        db.session.add(session)
+        db.session.commit()
+
+        with self._lock:
+            self._apply(jti, user.id, session.created_at, session.expires_at, False)
+        return token
+
+    def revoke(self, jtis, commit=True):
+        """Revoca sesiones concretas con un único UPDATE"""
+        if not jtis:
+            return 0
+        sqlite_profile.begin_write(db.session)
+        user_ids = db.session.execute(
+            update(UserSession)
+            .where(UserSession.jti.in_(jtis), UserSession.revoked == False)
+            .values(revoked=True, updated_at=datetime.utcnow())
+            .returning(UserSession.user_id)).scalars().all()
+        if commit:
+            db.session.commit()
+        with self._lock:
+            for jti in jtis:
+                self._drop(jti)
+        # La caché compartida se indexa por token, no por jti: se vacían las entradas de esos usuarios
+        token_cache.evict_users(user_ids)
+        return len(user_ids)
+
+    def revoke_user(self, user_id):
+        """Cierra todas las sesiones del usuario ("cerrar sesión en todos lados")"""
+        sqlite_profile.begin_write(db.session)
+        result = db.session.execute(
+            update(UserSession)
+            .where(UserSession.user_id == user_id, UserSession.revoked == False)
+            .values(revoked=True, updated_at=datetime.utcnow()))
+        db.session.commit()
+        with self._lock:
+            for jti in list(self._by_user.get(user_id, ())):
+                self._drop(jti)
+        forget_tokens(user_id)
+        token_cache.evict_user(user_id)
+        return result.rowcount
+
+    def sweep(self, batch_size=1000, pause=0):
+        """Borra por lotes las sesiones expiradas y las revocadas hace más de la retención"""
+        total = 0
+        while True:
+            sqlite_profile.begin_write(db.session)
+            now = datetime.utcnow()
+            revoked_before = now - timedelta(seconds=self.revoked_retention)
+            ids = db.session.execute(
+                select(UserSession.id)
+                .where(or_(UserSession.expires_at < now,
+                           and_(UserSession.revoked == True, UserSession.updated_at < revoked_before)))
+                .order_by(UserSession.id)
+                .limit(batch_size)).scalars().all()
+            if not ids:
+                db.session.commit()
+                return total
+            db.session.execute(delete(UserSession).where(UserSession.id.in_(ids)))
+            db.session.commit()
+            total += len(ids)
+            if pause:
+                time.sleep(pause)
+
+
+session_registry = SessionRegistry()
@@ -0,0 +1,293 @@
+"""
+Caché de tokens verificados compartida por todos los workers del host.
+
+Vive en un fichero mapeado en memoria (por defecto en /dev/shm) dividido en
+slots de tamaño fijo y agrupados en buckets de WAYS slots. Cada slot guarda el
+hash del token, la expiración, el id de usuario, la generación del usuario y
+el valor en JSON. Los buckets se protegen con lock striping: un lock de hilo
+más un lock de registro fcntl sobre un byte por franja, así que dos procesos
+solo compiten si tocan la misma franja.
+
+Invalidar a un usuario no recorre la caché: incrementa su contador de
+generación (una tabla de contadores al principio del fichero, indexada por
+user_id módulo su tamaño) y las entradas con una generación anterior dejan de
+acertar. Dos usuarios que comparten contador se invalidan juntos, nada más.
+
+El nombre del fichero lleva la disposición (versión, slots, tamaño de slot,
+franjas, contadores): procesos con otra configuración, p. ej. durante un
+despliegue escalonado, usan otro fichero. Un fichero existente nunca se
+trunca, porque otros procesos pueden tenerlo mapeado.
+
+Las entradas caducan a los SHARED_CACHE_TTL segundos (o antes si el token
+expira), lo que acota cuánto tarda en notarse un cambio del usuario que no
+pasa por delete()/evict_user(). Las revocaciones de sesión no dependen de
+eso: token_required consulta el registro de sesiones también en los aciertos.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from api.metrics import metrics
+
+MAGIC = b'JWTCACH2'
+HEADER = struct.Struct('<8sIII')  # magic, número de slots, tamaño de slot, número de contadores
+SLOT_HEAD = struct.Struct('<16sdQIH')  # hash del token, expira (epoch), user_id, generación, largo del valor
+GENERATION = struct.Struct('<I')
+WAYS = 4
+
+
+def _default_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'jwt-auth-token-cache')
+
+
+class CacheLayoutError(Exception):
+    pass
+
+
+class SharedTokenCache:
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 30
+        self.slots = 0
+        self.slot_size = 0
+        self.generations = 0
+        self.path = None
+        self._fd = None
+        self._map = None
+        self._buckets = 0
+        self._stripes = 0
+        self._thread_locks = []
+        self._hash_key = b''
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SHARED_CACHE_ENABLED', True)
+        app.config.setdefault('SHARED_CACHE_PATH', _default_path())
+        app.config.setdefault('SHARED_CACHE_SLOTS', 65536)
+        app.config.setdefault('SHARED_CACHE_SLOT_SIZE', 256)
+        app.config.setdefault('SHARED_CACHE_STRIPES', 64)
+        app.config.setdefault('SHARED_CACHE_GENERATIONS', 65536)
+        app.config.setdefault('SHARED_CACHE_TTL', 30)
+        app.extensions['shared_token_cache'] = self
+        metrics.gauge('shared_cache.hit_rate', self.hit_rate)
+
+        self.enabled = app.config['SHARED_CACHE_ENABLED']
+        if not self.enabled or self._map is not None:
+            return
+
+        self.ttl = app.config['SHARED_CACHE_TTL']
+        self.slots = app.config['SHARED_CACHE_SLOTS'] // WAYS * WAYS
+        self.slot_size = app.config['SHARED_CACHE_SLOT_SIZE']
+        self._buckets = self.slots // WAYS
+        self._stripes = app.config['SHARED_CACHE_STRIPES']
+        self.generations = app.config['SHARED_CACHE_GENERATIONS']
+        self._thread_locks = [threading.Lock() for _ in range(self._stripes)]
+        # Hash con clave: un token solo acierta en apps con el mismo secreto y la misma base
+        self._hash_key = hashlib.sha256('|'.join((
+            os.environ.get('JWT_SECRET_KEY', 'default-secret-key'),
+            app.config.get('SQLALCHEMY_DATABASE_URI') or '',
+        )).encode()).digest()
+        layout = f'v2-{self.slots}x{self.slot_size}-{self._stripes}s-{self.generations}g'
+        self.path = f"{app.config['SHARED_CACHE_PATH']}-{layout}"
+        try:
+            self._open(self.path)
+        except (OSError, CacheLayoutError):
+            # Sin caché compartida se sigue funcionando, solo que sin sus aciertos
+            app.logger.exception('Shared token cache disabled')
+            self._close()
+
+    @property
+    def _slots_offset(self):
+        return HEADER.size + self.generations * GENERATION.size
+
+    def _open(self, path):
+        size = self._slots_offset + self.slots * self.slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Lock exclusivo del fichero entero mientras se valida o inicializa la cabecera
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            expected = HEADER.pack(MAGIC, self.slots, self.slot_size, self.generations)
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                # Fichero nuevo: nadie más lo tiene mapeado todavía
+                os.ftruncate(self._fd, size)
+            elif current != size:
+                # Nunca se trunca un fichero que otro proceso puede tener mapeado (SIGBUS)
+                raise CacheLayoutError(f'{path} has {current} bytes, expected {size}')
+            header = os.pread(self._fd, HEADER.size, 0)
+            if header == bytes(HEADER.size):
+                os.pwrite(self._fd, expected, 0)
+            elif header != expected:
+                raise CacheLayoutError(f'{path} has an unexpected header')
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _locked(self, bucket):
+        stripe = bucket % self._stripes
+        with self._thread_locks[stripe]:
+            # Un byte por franja, más allá del final del mapa para no pisar datos
+            offset = self._slots_offset + self.slots * self.slot_size + stripe
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    def _locate(self, token):
+        digest = hashlib.blake2b(token.encode(), digest_size=16, key=self._hash_key).digest()
+        bucket = int.from_bytes(digest[:8], 'little') % self._buckets
+        return digest, bucket
+
+    def _slot_offset(self, bucket, way):
+        return self._slots_offset + (bucket * WAYS + way) * self.slot_size
+
+    def _generation_offset(self, user_id):
+        return HEADER.size + (user_id % self.generations) * GENERATION.size
+
+    def generation(self, user_id):
+        """Generación actual del usuario; pasarla a set() si se leyó antes de cargar el valor"""
+        if self._map is None:
+            return 0
+        return GENERATION.unpack_from(self._map, self._generation_offset(user_id))[0]
+
+    def get(self, token):
+        """Valor cacheado para el token, o None"""
+        if self._map is None:
+            return None
+        digest, bucket = self._locate(token)
+        now = time.time()
+        with self._locked(bucket):
+            for way in range(WAYS):
+                offset = self._slot_offset(bucket, way)
+                key, expires, user_id, generation, length = SLOT_HEAD.unpack_from(self._map, offset)
+                if key == digest and expires > now:
+                    if generation != self.generation(user_id):
+                        # El usuario se invalidó después de guardar la entrada
+                        SLOT_HEAD.pack_into(self._map, offset, bytes(16), 0.0, 0, 0, 0)
+                        value = None
+                        break
+                    start = offset + SLOT_HEAD.size
+                    value = bytes(self._map[start:start + length])
+                    break
+            else:
+                value = None
+        if value is None:
+            metrics.incr('shared_cache.misses')
+            return None
+        metrics.incr('shared_cache.hits')
+        return json.loads(value)
+
+    def set(self, token, value, user_id, expires_at, generation=None):
+        """Guarda el valor hasta expires_at (acotado por el TTL de la caché)
+
+        generation es la de generation(user_id) leída antes de cargar el valor: si el usuario
+        se invalida mientras tanto, la entrada nace ya caducada.
+        """
+        if self._map is None:
+            return False
+        if generation is None:
+            generation = self.generation(user_id)
+        data = json.dumps(value, separators=(',', ':')).encode()
+        if SLOT_HEAD.size + len(data) > self.slot_size:
+            return False
+        digest, bucket = self._locate(token)
+        now = time.time()
+        expires = min(expires_at, now + self.ttl)
+        with self._locked(bucket):
+            # Mismo token, luego un slot vacío o caducado, y si no el que antes caduque
+            victim, victim_expires = 0, None
+            for way in range(WAYS):
+                key, slot_expires, _, _, _ = SLOT_HEAD.unpack_from(self._map, self._slot_offset(bucket, way))
+                if key == digest or slot_expires <= now:
+                    victim = way
+                    break
+                if victim_expires is None or slot_expires < victim_expires:
+                    victim, victim_expires = way, slot_expires
+            offset = self._slot_offset(bucket, victim)
+            SLOT_HEAD.pack_into(self._map, offset, digest, expires, user_id, generation, len(data))
+            self._map[offset + SLOT_HEAD.size:offset + SLOT_HEAD.size + len(data)] = data
+        return True
+
+    def delete(self, token):
+        if self._map is None:
+            return
+        digest, bucket = self._locate(token)
+        with self._locked(bucket):
+            for way in range(WAYS):
+                offset = self._slot_offset(bucket, way)
+                if SLOT_HEAD.unpack_from(self._map, offset)[0] == digest:
+                    SLOT_HEAD.pack_into(self._map, offset, bytes(16), 0.0, 0, 0, 0)
+
+    def evict_user(self, user_id):
+        """Invalida todas las entradas de un usuario (incrementa su generación)"""
+        return self.evict_users((user_id,))
+
+    def evict_users(self, user_ids):
+        """Como evict_user para varios usuarios; devuelve cuántos contadores incrementó"""
+        if self._map is None:
+            return 0
+        indexes = {user_id % self.generations for user_id in user_ids}
+        for index in indexes:
+            offset = self._generation_offset(index)
+            # El incremento es leer-modificar-escribir: bajo el lock de una franja
+            with self._locked(index):
+                current = GENERATION.unpack_from(self._map, offset)[0]
+                GENERATION.pack_into(self._map, offset, (current + 1) & 0xFFFFFFFF)
+        return len(indexes)
+
+    def clear(self):
+        """Vacía la caché entera (p. ej. si se perdieron avisos de invalidación)"""
+        if self._map is None:
+            return
+        for stripe in range(self._stripes):
+            with self._locked(stripe):
+                for bucket in range(stripe, self._buckets, self._stripes):
+                    for way in range(WAYS):
+                        SLOT_HEAD.pack_into(self._map, self._slot_offset(bucket, way), bytes(16), 0.0, 0, 0, 0)
+
+    def hit_rate(self):
+        hits = metrics.counter('shared_cache.hits')
+        total = hits + metrics.counter('shared_cache.misses')
+        return round(hits / total, 4) if total else 0.0
+
+    def stats(self):
+        """Ocupación y memoria de la caché (recorre todos los slots)"""
+        if self._map is None:
+            return {'enabled': False}
+        now = time.time()
+        live = sum(
+            1 for slot in range(self.slots)
+            if SLOT_HEAD.unpack_from(self._map, self._slots_offset + slot * self.slot_size)[1] > now)
+        return {
+            'enabled': True,
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'live_entries': live,
+            'generations': self.generations,
+            'path': self.path,
+            'bytes': len(self._map),
+            'bytes_per_million_entries': self.slot_size * 1000000,
+            'hit_rate': self.hit_rate(),
+        }
+
+
+token_cache = SharedTokenCache()
@@ -0,0 +1,59 @@
+"""
+Single-flight: agrupa llamadas concurrentes con la misma clave en una sola.
+
+El primer hilo (líder) ejecuta la función; los que llegan mientras tanto
+(seguidores) esperan y reciben el mismo resultado o la misma excepción.
+"""
+import threading
+from api.metrics import metrics
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        metrics.gauge(f'singleflight.{name}.coalescing_ratio', self.coalescing_ratio)
+
+    def do(self, key, func):
+        """Ejecuta func una sola vez por clave en curso; devuelve (resultado, compartido)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f'singleflight.{self.name}.coalesced')
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        metrics.incr(f'singleflight.{self.name}.executed')
+        try:
+            call.result = func()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, False
+
+    def coalescing_ratio(self):
+        """Fracción de llamadas que se resolvieron con el resultado de otra"""
+        coalesced = metrics.counter(f'singleflight.{self.name}.coalesced')
+        total = coalesced + metrics.counter(f'singleflight.{self.name}.executed')
+        return round(coalesced / total, 4) if total else 0.0
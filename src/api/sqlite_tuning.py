@@ -0,0 +1,94 @@
+"""
+Perfil de SQLite para despliegues de un solo nodo.
+
+Sin DATABASE_URL la app usa un fichero SQLite. Con SQLITE_TUNED (por
+defecto activo en SQLite) cada conexión nueva recibe al abrirse:
+
+- journal_mode=WAL: los lectores no bloquean al escritor ni al revés.
+- synchronous=NORMAL: en WAL solo se sincroniza en los checkpoints.
+- cache_size, mmap_size y temp_store para tener las páginas calientes en memoria.
+- busy_timeout: un escritor espera al otro en vez de fallar con "database is locked".
+
+Además se toma el control del BEGIN (pysqlite lo emite a su manera y rompe
+los SAVEPOINT), que es lo que necesita la cola de escritura (write_queue.py).
+
+Una transacción que empieza con BEGIN (diferido) y lee no puede pasar luego a
+escribir si otra conexión escribió entremedio: SQLite devuelve "database is
+locked" al momento, sin esperar busy_timeout. Los caminos que leen y después
+escriben (login, sesiones, auditoría, barridos) llaman antes a begin_write(),
+que abre la transacción con BEGIN IMMEDIATE: el lock de escritura se toma al
+empezar y, si está ocupado, se espera busy_timeout.
+"""
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # en KiB cuando es negativo: 64 MiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # ms
+}
+
+
+class SQLiteProfile:
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.pragmas = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        is_sqlite = (app.config.get('SQLALCHEMY_DATABASE_URI') or '').startswith('sqlite')
+        app.config.setdefault('SQLITE_TUNED', is_sqlite)
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        self.enabled = is_sqlite and app.config['SQLITE_TUNED']
+        self.pragmas = {**DEFAULT_PRAGMAS, **app.config['SQLITE_PRAGMAS']}
+        app.extensions['sqlite_profile'] = self
+        if self.enabled and not event.contains(Engine, 'connect', self._on_connect):
+            event.listen(Engine, 'connect', self._on_connect)
+            event.listen(Engine, 'begin', self._on_begin)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        # Sin BEGIN implícito de pysqlite: lo emite _on_begin
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    def _on_begin(self, connection):
+        options = connection.get_execution_options()
+        # En AUTOCOMMIT (p. ej. autocommit_block de Alembic) no hay transacción que abrir
+        if connection.dialect.name == 'sqlite' and options.get('isolation_level') != 'AUTOCOMMIT':
+            connection.exec_driver_sql('BEGIN IMMEDIATE' if options.get('sqlite_write') else 'BEGIN')
+
+    def begin_write(self, session):
+        """Deja la sesión en una transacción de escritura (BEGIN IMMEDIATE en SQLite)
+
+        Confirma antes lo que la sesión tuviera abierto (solo lecturas en los caminos que la
+        usan). Si la transacción actual ya es de escritura no hace nada. Fuera de SQLite no
+        cambia nada.
+        """
+        if not self.enabled:
+            return
+        if isinstance(session, scoped_session):
+            session = session()
+        if session.in_transaction():
+            if session.connection().get_execution_options().get('sqlite_write'):
+                return
+            session.commit()
+        session.connection(execution_options={'sqlite_write': True})
+
+    def settings(self, connection):
+        """Valores efectivos de los pragmas en una conexión (para diagnóstico)"""
+        return {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in self.pragmas}
+
+
+sqlite_profile = SQLiteProfile()
@@ -0,0 +1,155 @@
+"""
+Servido del build de la SPA (dist/) desde el propio backend.
+
+Al arrancar se recorre dist/ una sola vez y se arma un manifiesto con el
+tamaño, la fecha, el ETag y el tipo MIME de cada fichero, más sus variantes
+precomprimidas (.br, .gz) si existen. Por request no se toca el disco salvo
+para enviar el fichero (send_file usa el file_wrapper del servidor WSGI, es
+decir sendfile en gunicorn).
+
+Los ficheros con hash en el nombre (assets/index-3f9a1c2b.js) no cambian
+nunca, así que se cachean un año como immutable; index.html y el resto se
+revalidan siempre con ETag (304 si no cambió).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from flask import abort, request, send_file
+from api.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli no instalado
+    brotli = None
+
+# Variantes precomprimidas por orden de preferencia: (encoding, extensión)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Nombres con hash de contenido que genera Vite en assets/: name-[hash].ext
+HASHED_NAME = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$')
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                'application/xml', 'application/manifest+json', 'application/wasm')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _digest(path):
+    h = hashlib.blake2b(digest_size=12)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StaticAsset:
+    __slots__ = ('path', 'mimetype', 'etag', 'mtime', 'immutable', 'variants')
+
+    def __init__(self, path, relative):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(relative)[0] or 'application/octet-stream'
+        self.etag = _digest(path)
+        self.mtime = os.stat(path).st_mtime
+        self.immutable = HASHED_NAME.match(relative) is not None
+        self.variants = {}  # encoding -> ruta del fichero precomprimido
+
+
+class StaticSite:
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.index = 'index.html'
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_SITE_DIR', None)
+        app.config.setdefault('STATIC_SITE_INDEX', 'index.html')
+        self.directory = app.config['STATIC_SITE_DIR']
+        self.index = app.config['STATIC_SITE_INDEX']
+        app.extensions['static_site'] = self
+        if self.directory:
+            self.scan()
+
+    def scan(self):
+        """Arma el manifiesto de dist/; se llama al arrancar (o tras un nuevo build)"""
+        manifest = {}
+        variants = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                if relative.endswith(tuple(ext for _, ext in ENCODINGS)):
+                    variants.append((relative, path))
+                else:
+                    manifest[relative] = StaticAsset(path, relative)
+
+        for relative, path in variants:
+            for encoding, ext in ENCODINGS:
+                asset = manifest.get(relative[:-len(ext)]) if relative.endswith(ext) else None
+                # Una variante más vieja que el original es de un build anterior
+                if asset is not None and os.stat(path).st_mtime >= asset.mtime:
+                    asset.variants[encoding] = path
+
+        self.manifest = manifest
+        return len(manifest)
+
+    def _negotiate(self, asset):
+        if not asset.variants:
+            return None, asset.path
+        accepted = request.accept_encodings
+        for encoding, _ in ENCODINGS:
+            if encoding in asset.variants and accepted[encoding] > 0:
+                return encoding, asset.variants[encoding]
+        return None, asset.path
+
+    def serve(self, path):
+        asset = self.manifest.get(path)
+        if asset is None:
+            # Rutas del router de React -> index.html; un fichero que no existe -> 404
+            if path.startswith('api/') or '.' in path.rsplit('/', 1)[-1]:
+                abort(404)
+            asset = self.manifest.get(self.index)
+            if asset is None:
+                abort(404)
+
+        encoding, file_path = self._negotiate(asset)
+        metrics.incr(f'static.served.{encoding or "identity"}')
+        response = send_file(
+            file_path, mimetype=asset.mimetype, conditional=True,
+            etag=asset.etag + ('-' + encoding if encoding else ''),
+            last_modified=asset.mtime,
+            max_age=IMMUTABLE_MAX_AGE if asset.immutable else 0)
+
+        if encoding is not None:
+            response.content_encoding = encoding
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        if asset.immutable:
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    def compress(self, min_size=1024, level=9):
+        """Genera las variantes .gz (y .br si está brotli) de los ficheros comprimibles"""
+        written = 0
+        for asset in self.manifest.values():
+            if not asset.mimetype.startswith(COMPRESSIBLE) or os.path.getsize(asset.path) < min_size:
+                continue
+            with open(asset.path, 'rb') as f:
+                data = f.read()
+            outputs = [('.gz', gzip.compress(data, compresslevel=level, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', brotli.compress(data, quality=11)))
+            for ext, compressed in outputs:
+                # Solo si ahorra algo: si no, mejor servir el original
+                if len(compressed) < len(data):
+                    with open(asset.path + ext, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+        self.scan()
+        return written
+
+
+static_site = StaticSite()
@@ -0,0 +1,60 @@
+"""
+Resolución del tenant (aplicación cliente) de cada request.
+
+Sin token, el tenant sale del host de la petición (TENANT_HOSTS); con token,
+del claim tenant_id, que además debe coincidir con el del host si el host
+pertenece a un tenant concreto.
+"""
+from flask import current_app, request
+from api.models import DEFAULT_TENANT
+
+
+def parse_tenant_hosts(value):
+    """Convierte "app1.example.com=app1,app2.example.com=app2" en un dict host -> tenant"""
+    hosts = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            host, tenant = item.split('=', 1)
+            hosts[host.strip().lower()] = tenant.strip()
+    return hosts
+
+
+def host_tenant():
+    """Tenant asociado al host de la petición, o None si el host no tiene uno"""
+    host = request.host.rsplit(':', 1)[0].lower()
+    return current_app.config.get('TENANT_HOSTS', {}).get(host)
+
+
+def resolve_tenant(payload=None):
+    """Tenant de la petición; None si el token y el host no coinciden"""
+    tenant = host_tenant()
+    if payload is None:
+        return tenant or DEFAULT_TENANT
+    token_tenant = payload.get('tenant_id', DEFAULT_TENANT)
+    if tenant is not None and tenant != token_tenant:
+        return None
+    return token_tenant
+
+
+def partition_ddl(tenants):
+    """DDL opcional de Postgres con la tabla "user" particionada por LIST (tenant_id)"""
+    statements = [
+        'CREATE TABLE "user_partitioned" (\n'
+        '    id INTEGER NOT NULL DEFAULT nextval(\'user_id_seq\'),\n'
+        "    tenant_id VARCHAR(64) NOT NULL DEFAULT 'default',\n"
+        '    email VARCHAR(120) NOT NULL,\n'
+        '    password VARCHAR NOT NULL,\n'
+        '    is_active BOOLEAN NOT NULL,\n'
+        '    last_login_at TIMESTAMP WITHOUT TIME ZONE,\n'
+        '    PRIMARY KEY (tenant_id, id),\n'
+        '    CONSTRAINT uq_user_partitioned_tenant_email UNIQUE (tenant_id, email)\n'
+        ') PARTITION BY LIST (tenant_id);'
+    ]
+    for tenant in tenants:
+        name = ''.join(c if c.isalnum() else '_' for c in tenant.lower())
+        literal = tenant.replace("'", "''")
+        statements.append(
+            f'CREATE TABLE "user_p_{name}" PARTITION OF "user_partitioned" '
+            f"FOR VALUES IN ('{literal}');")
+    statements.append('CREATE TABLE "user_partitioned_default" PARTITION OF "user_partitioned" DEFAULT;')
+    return '\n'.join(statements)
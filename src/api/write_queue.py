@@ -0,0 +1,115 @@
+"""
+Cola de un solo escritor para inserciones con mucha concurrencia (signups).
+
+SQLite admite un único escritor a la vez: con varios hilos escribiendo, todos
+compiten por el lock y algunos acaban en "database is locked". Con la cola,
+las peticiones hacen el trabajo caro (hash de la contraseña) en su hilo y
+encolan solo la escritura; un hilo del worker las ejecuta en orden, cada una
+en su SAVEPOINT, y confirma el lote con un único COMMIT (un solo fsync para
+todo el lote). Un error en una escritura (p. ej. email duplicado) solo afecta
+a esa petición.
+
+Fuera de SQLite (o con WRITE_QUEUE_ENABLED=0) submit() ejecuta la función en
+la sesión de la petición, en una transacción propia, y hace commit.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from api.metrics import metrics
+from api.models import db
+from api.sqlite_tuning import sqlite_profile
+
+
+class WriteQueue:
+
+    def __init__(self, name, app=None):
+        self.name = name
+        self.app = None
+        self.enabled = False
+        self.batch_size = 64
+        self.timeout = 10
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        is_sqlite = (app.config.get('SQLALCHEMY_DATABASE_URI') or '').startswith('sqlite')
+        app.config.setdefault('WRITE_QUEUE_ENABLED', is_sqlite)
+        app.config.setdefault('WRITE_QUEUE_BATCH_SIZE', 64)
+        app.config.setdefault('WRITE_QUEUE_TIMEOUT', 10)
+        self.app = app
+        self.enabled = app.config['WRITE_QUEUE_ENABLED']
+        self.batch_size = app.config['WRITE_QUEUE_BATCH_SIZE']
+        self.timeout = app.config['WRITE_QUEUE_TIMEOUT']
+        app.extensions.setdefault('write_queues', {})[self.name] = self
+        metrics.gauge(f'write_queue.{self.name}.depth', self._queue.qsize)
+
+    def submit(self, func):
+        """Ejecuta func() (que escribe con db.session) y devuelve su resultado ya confirmado"""
+        if not self.enabled:
+            # La escritura va en su propia transacción de escritura: en SQLite una transacción que
+            # ya leyó no puede pasar a escribir mientras otro escribe (SQLITE_BUSY sin esperar)
+            sqlite_profile.begin_write(db.session)
+            try:
+                result = func()
+                db.session.commit()
+                return result
+            except Exception:
+                db.session.rollback()
+                raise
+
+        future = Future()
+        self._queue.put((func, future, time.perf_counter()))
+        self._ensure_thread()
+        return future.result(self.timeout)
+
+    def _ensure_thread(self):
+        # Se arranca en el primer uso: así cada worker de gunicorn tiene el suyo tras el fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=f'write-queue-{self.name}',
+                                                    daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                self._execute(jobs)
+                db.session.remove()
+
+    def _execute(self, jobs):
+        results = []
+        sqlite_profile.begin_write(db.session)
+        for func, future, queued_at in jobs:
+            metrics.observe(f'write_queue.{self.name}.wait', time.perf_counter() - queued_at)
+            try:
+                with db.session.begin_nested():
+                    results.append((future, func(), None))
+            except Exception as error:
+                results.append((future, None, error))
+        try:
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            self.app.logger.exception('Write queue %s commit failed', self.name)
+            results = [(future, None, error) for future, _, _ in results]
+        metrics.incr(f'write_queue.{self.name}.batches')
+        metrics.incr(f'write_queue.{self.name}.writes', len(jobs))
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+signup_writer = WriteQueue('signup')
@@ -5,11 +5,28 @@ import os
 from flask import Flask, request, jsonify, url_for, send_from_directory
 from flask_migrate import Migrate
 from flask_swagger import swagger
-from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from api.utils import APIException, generate_sitemap
+from api.metrics import metrics
 from api.models import db, bcrypt
 from api.routes import api
-# from api.admin import setup_admin  # Comentado para evitar conflictos de dependencias
+from api.replicas import replica_router, REPLICA_BIND_PREFIX
+from api.sessions import session_registry
+from api.access_log import access_log
+from api.idempotency import idempotency_store
+from api.tenants import parse_tenant_hosts
+from api.schemas import swagger_template
+from api.limits import request_limits
+from api.health import health
+from api.shared_cache import token_cache
+from api.hashers import password_hashers
+from api.static_files import static_site
+from api.cors import cors_policy
+from api.audit import audit_log
+from api.invalidation import invalidation_bus
+from api.sqlite_tuning import sqlite_profile
+from api.write_queue import signup_writer
+from api.admin import setup_admin
 from api.commands import setup_commands
 
 # from models import Person
@@ -20,9 +37,6 @@ static_file_dir = os.path.join(os.path.dirname(
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 
-# Enable CORS for all domains and routes
-CORS(app)
-
 # JWT Configuration
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-in-production')
 
@@ -34,15 +48,91 @@ if db_url is not None:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 
+# read replicas opcionales, separadas por comas: las lecturas de auth van a ellas
+replica_urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+app.config['SQLALCHEMY_BINDS'] = {
+    REPLICA_BIND_PREFIX + str(index): url.replace("postgres://", "postgresql://")
+    for index, url in enumerate(replica_urls)
+}
+# read-your-writes: segundos en que un cliente que acaba de escribir lee de la primaria
+app.config['REPLICA_READ_YOUR_WRITES_WINDOW'] = float(os.getenv("REPLICA_READ_YOUR_WRITES_WINDOW", 5))
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# SQLite de un solo nodo: WAL y pragmas al conectar, y los signups por una cola de un solo escritor
+app.config['SQLITE_TUNED'] = os.getenv("SQLITE_TUNED", "1") == "1"
+if os.getenv("WRITE_QUEUE_ENABLED"):
+    app.config['WRITE_QUEUE_ENABLED'] = os.getenv("WRITE_QUEUE_ENABLED") == "1"
+
+# Tamaño máximo del cuerpo: global y por blueprint (cada esquema puede bajarlo más)
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_CONTENT_LENGTH", 1024 * 1024))
+app.config['BLUEPRINT_MAX_CONTENT_LENGTH'] = {'api': int(os.getenv("API_MAX_CONTENT_LENGTH", 64 * 1024))}
+
+# Caché de tokens verificados compartida por los workers del host (mmap)
+app.config['SHARED_CACHE_ENABLED'] = os.getenv("SHARED_CACHE_ENABLED", "1") == "1"
+app.config['SHARED_CACHE_TTL'] = int(os.getenv("SHARED_CACHE_TTL", 30))
+
+# Avisos de cambios en usuarios entre workers: LISTEN/NOTIFY en Postgres, polling en SQLite
+app.config['INVALIDATION_ENABLED'] = os.getenv("INVALIDATION_ENABLED", "1") == "1"
+app.config['INVALIDATION_POLL_INTERVAL'] = float(os.getenv("INVALIDATION_POLL_INTERVAL", 1.0))
+
+# Algoritmo de hash para contraseñas nuevas; los demás se migran al hacer login
+if os.getenv("PASSWORD_HASHER"):
+    app.config['PASSWORD_HASHER'] = os.getenv("PASSWORD_HASHER")
+
+# Servir el build de React (dist/) desde el backend: SERVE_FRONTEND=1
+app.config['SERVE_FRONTEND'] = os.getenv("SERVE_FRONTEND", "0") == "1"
+app.config['STATIC_SITE_DIR'] = static_file_dir if app.config['SERVE_FRONTEND'] else None
+
+# CORS: orígenes permitidos separados por comas ("*" = todos) y cuánto cachea el navegador el preflight
+app.config['CORS_ORIGINS'] = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
+app.config['CORS_MAX_AGE'] = int(os.getenv("CORS_MAX_AGE", 600))
+
+# Hosts de cada tenant: TENANT_HOSTS="app1.example.com=app1,app2.example.com=app2"
+app.config['TENANT_HOSTS'] = parse_tenant_hosts(os.getenv("TENANT_HOSTS"))
+
+# Sesiones simultáneas por usuario; al superarlo se revoca la más antigua
+app.config['MAX_SESSIONS_PER_USER'] = int(os.getenv("MAX_SESSIONS_PER_USER", 5))
+# segundos que se conservan las sesiones revocadas antes de borrarlas (ver api/sessions.py)
+app.config['SESSION_REVOKED_RETENTION'] = int(os.getenv("SESSION_REVOKED_RETENTION", 3600))
+
+# Logs de acceso JSON: fracción de respuestas no-error que se registran
+app.config['ACCESS_LOG_SAMPLE_RATE'] = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 1.0))
+app.config['ACCESS_LOG_FILE'] = os.getenv("ACCESS_LOG_FILE")
+
+# Audit log de logins: se escribe por lotes de AUDIT_FLUSH_SIZE o cada AUDIT_FLUSH_INTERVAL segundos
+app.config['AUDIT_FLUSH_SIZE'] = int(os.getenv("AUDIT_FLUSH_SIZE", 500))
+app.config['AUDIT_FLUSH_INTERVAL'] = float(os.getenv("AUDIT_FLUSH_INTERVAL", 2))
+
+# Máximo de tokens aceptados por /api/tokens/verify-batch
+app.config['TOKEN_VERIFY_BATCH_MAX'] = int(os.getenv("TOKEN_VERIFY_BATCH_MAX", 100))
 MIGRATE = Migrate(app, db, compare_type=True)
+# Detrás de un proxy (Render, Heroku): cuántos saltos de X-Forwarded-For/-Proto son de confianza.
+# Sin esto remote_addr es la del proxy, pero el header no se puede falsificar
+trusted_proxy_hops = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+if trusted_proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxy_hops, x_proto=trusted_proxy_hops)
+# CORS for all domains and routes, answered before routing (see api/cors.py)
+cors_policy.init_app(app)
+sqlite_profile.init_app(app)
 db.init_app(app)
-
-# Initialize bcrypt
+signup_writer.init_app(app)
+replica_router.init_app(app)
+session_registry.init_app(app)
+access_log.init_app(app)
+idempotency_store.init_app(app)
+request_limits.init_app(app)
+token_cache.init_app(app)
+static_site.init_app(app)
+audit_log.init_app(app)
+invalidation_bus.init_app(app)
+
+# Initialize bcrypt and the password hasher registry (argon2id preferred when installed)
 bcrypt.init_app(app)
+password_hashers.init_app(app, bcrypt)
 
-# add the admin
-# setup_admin(app)  # Comentado para evitar conflictos
+# add the admin (/admin, HTTP Basic with ADMIN_USERNAME / ADMIN_PASSWORD)
+setup_admin(app)
 
 # add the admin
 setup_commands(app)
@@ -50,6 +140,9 @@ setup_commands(app)
 # Add all endpoints form the API with a "api" prefix
 app.register_blueprint(api, url_prefix='/api')
 
+# /healthz and /readyz at the root
+app.register_blueprint(health)
+
 # Handle/serialize errors like a JSON object
 
 
@@ -64,16 +157,33 @@ def handle_invalid_usage(error):
 def sitemap():
     if ENV == "development":
         return generate_sitemap(app)
+    if app.config['SERVE_FRONTEND']:
+        return static_site.serve('index.html')
     return {"message": "JWT Auth API is running", "endpoints": "/api/*"}
 
-# Commented out to avoid serving frontend files from backend
-# @app.route('/<path:path>', methods=['GET'])
-# def serve_any_other_file(path):
-#     if not os.path.isfile(os.path.join(static_file_dir, path)):
-#         path = 'index.html'
-#     response = send_from_directory(static_file_dir, path)
-#     response.cache_control.max_age = 0  # avoid cache memory
-#     return response
+# OpenAPI (swagger 2.0) spec generated from the request schemas
+
+
+@app.route('/swagger.json')
+def swagger_spec():
+    spec = swagger(app, template=swagger_template(app))
+    spec['info'] = {'title': 'JWT Auth API', 'version': '1.0.0'}
+    return jsonify(spec)
+
+
+# in-process metrics (counters, timings, gauges) as JSON
+
+
+@app.route('/metrics')
+def get_metrics():
+    return jsonify(metrics.snapshot()), 200
+
+
+# Frontend build served from a manifest of dist/ built at startup (SERVE_FRONTEND=1)
+if app.config['SERVE_FRONTEND']:
+    @app.route('/<path:path>', methods=['GET'])
+    def serve_any_other_file(path):
+        return static_site.serve(path)
 
 
 # this only runs if `$ python src/main.py` is executed
@@ -23,14 +23,22 @@ const handleApiError = (error) => {
  */
 const makeRequest = async (url, options = {}) => {
   try {
+    // Read-your-writes: devolver la hora de la última escritura para leer de la primaria
+    const lastWrite = sessionStorage.getItem("lastWrite");
     const response = await fetch(url, {
+      ...options,
       headers: {
         "Content-Type": "application/json",
+        ...(lastWrite ? { "X-Last-Write": lastWrite } : {}),
         ...options.headers,
       },
-      ...options,
     });
 
+    const written = response.headers.get("X-Last-Write");
+    if (written) {
+      sessionStorage.setItem("lastWrite", written);
+    }
+
     const data = await response.json();
 
     if (!response.ok) {
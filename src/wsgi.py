@@ -1,7 +1,22 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
+import os
 from app import app as application
+from api.scheduler import scheduler
+from api.health import warm_up
+
+# Calienta pool, bcrypt y JWT antes de que el worker acepte tráfico.
+# Si la base no responde al arrancar el worker igual levanta: /readyz reintenta
+if os.getenv("WARM_UP", "1") == "1":
+    try:
+        warm_up(application)
+    except Exception:
+        application.logger.exception('Warm-up failed at boot, /readyz will retry')
+
+# Tareas periódicas dentro de cada worker; el lock de líder evita duplicarlas
+if os.getenv("SCHEDULER_ENABLED") == "1":
+    scheduler.start()
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,30 @@
+"""
+Configuración común de los tests: la app se importa con una base SQLite
+temporal, así que la suite no necesita Postgres ni un servidor corriendo
+(para probar contra uno, ver test_api.py).
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix='jwt-auth-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+os.environ.setdefault('ACCESS_LOG_SAMPLE_RATE', '0')
+os.environ.setdefault('INVALIDATION_POLL_INTERVAL', '0.05')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from app import app as flask_app  # noqa: E402
+from api.models import db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
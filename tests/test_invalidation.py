@@ -0,0 +1,79 @@
+"""Bus de invalidación con el fallback de polling (SQLite)"""
+import time
+
+import pytest
+from sqlalchemy import insert
+
+from api.invalidation import invalidation_bus
+from api.metrics import metrics
+from api.models import db, User, InvalidationEvent, _token_cache
+from api.shared_cache import token_cache
+
+
+def _propagations():
+    return metrics.snapshot()['timings'].get('invalidation.propagation', {}).get('count', 0)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def bus(app):
+    with app.app_context():
+        invalidation_bus.start()
+    yield invalidation_bus
+    invalidation_bus.stop()
+
+
+@pytest.fixture
+def user_id(app):
+    with app.app_context():
+        user = User(email=f'invalidation-{time.time_ns()}@example.com', is_active=True)
+        user.set_password('123456')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    yield user_id
+    with app.app_context():
+        db.session.delete(db.session.get(User, user_id))
+        db.session.commit()
+
+
+def test_event_from_another_worker_evicts_caches(app, bus, user_id):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        token = user.generate_token()
+        token_cache.set(token, {'user_id': user_id}, user_id, time.time() + 60,
+                        generation=token_cache.generation(user_id))
+        assert token_cache.get(token) is not None
+        assert any(key[0] == user_id for key in _token_cache)
+        before = _propagations()
+
+        # Otro worker confirmó un cambio: aquí solo se ve la fila en invalidation_event
+        db.session.execute(insert(InvalidationEvent), [{'user_id': user_id, 'published_at': time.time()}])
+        db.session.commit()
+
+    assert _wait_for(lambda: _propagations() > before)
+    assert token_cache.get(token) is None
+    assert not any(key[0] == user_id for key in _token_cache)
+    assert metrics.counter('invalidation.received') >= 1
+
+
+def test_unrelated_event_keeps_cache(app, bus, user_id):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        token = user.generate_token()
+        token_cache.set(token, {'user_id': user_id}, user_id, time.time() + 60,
+                        generation=token_cache.generation(user_id))
+        before = _propagations()
+        db.session.execute(insert(InvalidationEvent), [{'user_id': user_id + 1, 'published_at': time.time()}])
+        db.session.commit()
+
+    assert _wait_for(lambda: _propagations() > before)
+    assert token_cache.get(token) is not None